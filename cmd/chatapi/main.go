@@ -19,9 +19,10 @@ import (
 )
 
 func main() {
-	// Initialize structured logging
+	// Initialize structured logging; the level defaults to info until config is loaded
+	logLevel := new(slog.LevelVar)
 	logger := slog.New(slog.NewJSONHandler(os.Stdout, &slog.HandlerOptions{
-		Level: slog.LevelInfo,
+		Level: logLevel,
 	}))
 	slog.SetDefault(logger)
 
@@ -35,6 +36,11 @@ func main() {
 		os.Exit(1)
 	}
 
+	// Apply the configured log level so disabled levels are skipped before any formatting
+	if err := logLevel.UnmarshalText([]byte(cfg.LogLevel)); err != nil {
+		slog.Warn("Invalid log level, using info", "log_level", cfg.LogLevel, "error", err)
+	}
+
 	// Initialize database
 	database, err := db.New(cfg.DatabaseDSN)
 	if err != nil {
@@ -52,7 +58,7 @@ func main() {
 	// Initialize services
 	tenantSvc := tenant.NewService(database.DB)
 	realtimeSvc := realtime.NewService(database.DB)
-	deliverySvc := delivery.NewService(database.DB, realtimeSvc)
+	deliverySvc := delivery.NewService(database.DB, realtimeSvc, cfg.RetryMaxAttempts, cfg.RetryInterval)
 
 	// Initialize workers
 	deliveryWorker := worker.NewDeliveryWorker(database, deliverySvc, cfg.WorkerInterval)
@@ -0,0 +1,3 @@
+-- Index dead notifications by age for the retention cleanup, which runs
+-- across all tenants
+CREATE INDEX idx_notifications_dead ON notifications(created_at) WHERE status = 'dead';
@@ -0,0 +1,3 @@
+-- Index queued messages by age for the retention cleanup, which removes
+-- exhausted entries across all tenants
+CREATE INDEX idx_undelivered_exhausted ON undelivered_messages(created_at, attempts);
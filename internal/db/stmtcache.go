@@ -0,0 +1,65 @@
+package db
+
+import (
+	"database/sql"
+	"fmt"
+	"sync"
+)
+
+// StmtCache lazily prepares SQL statements and reuses them across calls,
+// so hot queries are parsed by SQLite once instead of on every request
+type StmtCache struct {
+	db    *sql.DB
+	mu    sync.RWMutex
+	stmts map[string]*sql.Stmt
+}
+
+// NewStmtCache creates a new prepared statement cache for a database
+func NewStmtCache(db *sql.DB) *StmtCache {
+	return &StmtCache{
+		db:    db,
+		stmts: make(map[string]*sql.Stmt),
+	}
+}
+
+// Prepare returns the cached prepared statement for a query, preparing it on first use
+func (c *StmtCache) Prepare(query string) (*sql.Stmt, error) {
+	c.mu.RLock()
+	stmt, exists := c.stmts[query]
+	c.mu.RUnlock()
+	if exists {
+		return stmt, nil
+	}
+
+	c.mu.Lock()
+	defer c.mu.Unlock()
+
+	// Another goroutine may have prepared it while we waited for the lock
+	if stmt, exists := c.stmts[query]; exists {
+		return stmt, nil
+	}
+
+	stmt, err := c.db.Prepare(query)
+	if err != nil {
+		return nil, fmt.Errorf("failed to prepare statement: %w", err)
+	}
+	c.stmts[query] = stmt
+
+	return stmt, nil
+}
+
+// Close closes all cached statements
+func (c *StmtCache) Close() error {
+	c.mu.Lock()
+	defer c.mu.Unlock()
+
+	var firstErr error
+	for query, stmt := range c.stmts {
+		if err := stmt.Close(); err != nil && firstErr == nil {
+			firstErr = err
+		}
+		delete(c.stmts, query)
+	}
+
+	return firstErr
+}
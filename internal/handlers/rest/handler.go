@@ -245,15 +245,7 @@ func (h *Handler) HandleSendMessage(w http.ResponseWriter, r *http.Request) {
 	}
 
 	// Broadcast to realtime subscribers
-	h.realtimeSvc.BroadcastToRoom(tenantID, roomID, map[string]interface{}{
-		"type":       "message",
-		"room_id":    roomID,
-		"seq":        message.Seq,
-		"message_id": message.MessageID,
-		"sender_id":  message.SenderID,
-		"content":    message.Content,
-		"created_at": message.CreatedAt.Format("2006-01-02T15:04:05Z07:00"),
-	})
+	h.realtimeSvc.BroadcastToRoom(tenantID, roomID, models.NewMessageEvent(message))
 
 	w.Header().Set("Content-Type", "application/json")
 	json.NewEncoder(w).Encode(message)
@@ -311,11 +303,11 @@ func (h *Handler) HandleAck(w http.ResponseWriter, r *http.Request) {
 	}
 
 	// Broadcast ACK to other room members
-	h.realtimeSvc.BroadcastToRoom(tenantID, req.RoomID, map[string]interface{}{
-		"type":    "ack.received",
-		"room_id": req.RoomID,
-		"seq":     req.Seq,
-		"user_id": userID,
+	h.realtimeSvc.BroadcastToRoom(tenantID, req.RoomID, &models.WSAckEvent{
+		Type:   "ack.received",
+		RoomID: req.RoomID,
+		Seq:    req.Seq,
+		UserID: userID,
 	})
 
 	w.WriteHeader(http.StatusOK)
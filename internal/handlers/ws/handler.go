@@ -2,31 +2,80 @@ package ws
 
 import (
 	"encoding/json"
+	"fmt"
 	"log/slog"
 	"net/http"
+	"sync"
 	"time"
+	"unicode/utf8"
 
 	"github.com/gorilla/websocket"
 	"github.com/hastenr/chatapi/internal/models"
 	"github.com/hastenr/chatapi/internal/services/chatroom"
+	"github.com/hastenr/chatapi/internal/services/delivery"
 	"github.com/hastenr/chatapi/internal/services/message"
 	"github.com/hastenr/chatapi/internal/services/realtime"
 	"github.com/hastenr/chatapi/internal/services/tenant"
 )
 
 var upgrader = websocket.Upgrader{
+	// Chat frames are small; keep per-connection buffers tight
+	ReadBufferSize:  1024,
+	WriteBufferSize: 1024,
+	// Borrow write buffers only while a frame is being written instead of
+	// holding one per idle connection
+	WriteBufferPool: &sync.Pool{},
 	CheckOrigin: func(r *http.Request) bool {
 		// In production, implement proper origin checking
 		return true
 	},
 }
 
+// pongFrame answers application-level pings; it is encoded once since
+// keepalives are the most frequent frame an idle client sends
+var pongFrame = json.RawMessage(`{"type":"pong"}`)
+
+// reconnectSyncSem limits concurrent reconnect syncs
+var reconnectSyncSem = make(chan struct{}, 32)
+
+// maxFrameSize is the largest client frame accepted; chat commands are small,
+// so anything bigger is malformed or abusive
+const maxFrameSize = 64 * 1024
+
+// maxLoggedUserAgent caps how much of a client's User-Agent is logged
+const maxLoggedUserAgent = 64
+
+// typingInterval is the minimum gap between typing.start events forwarded
+// from one connection for the same room
+const typingInterval = time.Second
+
+// ackDebounce is how long acks for the same user and room are collected
+// before the highest one is stored and broadcast
+const ackDebounce = 500 * time.Millisecond
+
+// ackKey identifies a user's pending ack for one room
+type ackKey struct {
+	tenantID string
+	userID   string
+	roomID   string
+}
+
+// pendingAck is the highest seq acked for a key and the timer that will store it
+type pendingAck struct {
+	seq   int
+	timer *time.Timer
+}
+
 // Handler handles WebSocket connections
 type Handler struct {
 	tenantSvc   *tenant.Service
 	chatroomSvc *chatroom.Service
 	messageSvc  *message.Service
 	realtimeSvc *realtime.Service
+	deliverySvc *delivery.Service
+
+	acksMu      sync.Mutex
+	pendingAcks map[ackKey]*pendingAck // acked but not yet stored
 }
 
 // NewHandler creates a new WebSocket handler
@@ -35,12 +84,15 @@ func NewHandler(
 	chatroomSvc *chatroom.Service,
 	messageSvc *message.Service,
 	realtimeSvc *realtime.Service,
+	deliverySvc *delivery.Service,
 ) *Handler {
 	return &Handler{
 		tenantSvc:   tenantSvc,
 		chatroomSvc: chatroomSvc,
 		messageSvc:  messageSvc,
 		realtimeSvc: realtimeSvc,
+		deliverySvc: deliverySvc,
+		pendingAcks: make(map[ackKey]*pendingAck),
 	}
 }
 
@@ -76,10 +128,21 @@ func (h *Handler) HandleConnection(w http.ResponseWriter, r *http.Request) {
 		return
 	}
 
+	// Log a bounded fingerprint of the client rather than its headers, which carry credentials
+	slog.Debug("WebSocket client connecting",
+		"tenant_id", tenant.TenantID,
+		"user_id", userID,
+		"remote_addr", r.RemoteAddr,
+		"user_agent", truncate(r.UserAgent(), maxLoggedUserAgent))
+
 	// Upgrade to WebSocket
 	conn, err := upgrader.Upgrade(w, r, nil)
 	if err != nil {
-		slog.Error("Failed to upgrade connection", "error", err)
+		// The upgrader has already replied to the client; this is usually a bad handshake
+		slog.Warn("Failed to upgrade connection",
+			"tenant_id", tenant.TenantID,
+			"remote_addr", r.RemoteAddr,
+			"error", err)
 		return
 	}
 
@@ -90,24 +153,25 @@ func (h *Handler) HandleConnection(w http.ResponseWriter, r *http.Request) {
 	h.realtimeSvc.BroadcastPresenceUpdate(tenant.TenantID, userID, "online")
 
 	// Handle reconnect sync - send missed messages
-	go h.handleReconnectSync(tenant.TenantID, userID, conn)
+	go h.handleReconnectSync(tenant.TenantID, userID)
 
 	// Start connection handler
 	go h.handleConnection(tenant.TenantID, userID, conn)
 }
 
-// handleReconnectSync sends missed messages to a reconnecting client
-func (h *Handler) handleReconnectSync(tenantID, userID string, conn *websocket.Conn) {
-	// Get user's rooms
-	// This is a simplified implementation - in practice you'd query the database
-	// for rooms the user is a member of
-
-	// For now, we'll skip this and let the client request messages as needed
-	// In a full implementation, you'd:
-	// 1. Get user's rooms from database
-	// 2. For each room, get last_ack
-	// 3. Query messages where seq > last_ack
-	// 4. Send them in order
+// handleReconnectSync sends missed messages to a reconnecting client. It runs
+// off the connect path, and reconnectSyncSem bounds how many run at once so a
+// reconnect storm doesn't pile up on the database.
+func (h *Handler) handleReconnectSync(tenantID, userID string) {
+	reconnectSyncSem <- struct{}{}
+	defer func() { <-reconnectSyncSem }()
+
+	if err := h.deliverySvc.DeliverPendingToUser(tenantID, userID); err != nil {
+		slog.Warn("Failed to deliver pending messages on reconnect",
+			"tenant_id", tenantID,
+			"user_id", userID,
+			"error", err)
+	}
 }
 
 // handleConnection handles messages from a WebSocket connection
@@ -117,6 +181,9 @@ func (h *Handler) handleConnection(tenantID, userID string, conn *websocket.Conn
 		conn.Close()
 	}()
 
+	// Reject oversized frames at the socket before reading or decoding them
+	conn.SetReadLimit(maxFrameSize)
+
 	// Set read deadline
 	conn.SetReadDeadline(time.Now().Add(60 * time.Second))
 	conn.SetPongHandler(func(string) error {
@@ -124,6 +191,9 @@ func (h *Handler) handleConnection(tenantID, userID string, conn *websocket.Conn
 		return nil
 	})
 
+	// When each room last had a typing.start forwarded; owned by this loop
+	lastTyping := make(map[string]time.Time)
+
 	for {
 		_, message, err := conn.ReadMessage()
 		if err != nil {
@@ -144,7 +214,7 @@ func (h *Handler) handleConnection(tenantID, userID string, conn *websocket.Conn
 		}
 
 		// Handle message based on type
-		if err := h.handleMessage(tenantID, userID, &wsMsg); err != nil {
+		if err := h.handleMessage(tenantID, userID, conn, lastTyping, &wsMsg); err != nil {
 			slog.Error("Failed to handle WebSocket message",
 				"tenant_id", tenantID,
 				"user_id", userID,
@@ -155,16 +225,19 @@ func (h *Handler) handleConnection(tenantID, userID string, conn *websocket.Conn
 }
 
 // handleMessage processes different types of WebSocket messages
-func (h *Handler) handleMessage(tenantID, userID string, msg *models.WSMessage) error {
+func (h *Handler) handleMessage(tenantID, userID string, conn *websocket.Conn, lastTyping map[string]time.Time, msg *models.WSMessage) error {
 	switch msg.Type {
+	case "ping":
+		h.realtimeSvc.SendToConnection(tenantID, userID, conn, pongFrame)
+		return nil
 	case "send_message":
 		return h.handleSendMessage(tenantID, userID, msg.Data)
 	case "ack":
 		return h.handleAck(tenantID, userID, msg.Data)
 	case "typing.start":
-		return h.handleTyping(tenantID, userID, msg.Data, "start")
+		return h.handleTyping(tenantID, userID, lastTyping, msg.Data, "start")
 	case "typing.stop":
-		return h.handleTyping(tenantID, userID, msg.Data, "stop")
+		return h.handleTyping(tenantID, userID, lastTyping, msg.Data, "stop")
 	default:
 		slog.Warn("Unknown message type", "type", msg.Type, "tenant_id", tenantID, "user_id", userID)
 		return nil
@@ -172,28 +245,25 @@ func (h *Handler) handleMessage(tenantID, userID string, msg *models.WSMessage)
 }
 
 // handleSendMessage handles message sending via WebSocket
-func (h *Handler) handleSendMessage(tenantID, userID string, data interface{}) error {
-	msgData, ok := data.(map[string]interface{})
-	if !ok {
+func (h *Handler) handleSendMessage(tenantID, userID string, data json.RawMessage) error {
+	// A command without a payload has nothing to act on
+	if len(data) == 0 {
 		return nil
 	}
 
-	roomID, ok := msgData["room_id"].(string)
-	if !ok {
-		return nil
+	var msgData models.WSMessageSend
+	if err := json.Unmarshal(data, &msgData); err != nil {
+		return fmt.Errorf("invalid send_message payload: %w", err)
 	}
 
-	content, ok := msgData["content"].(string)
-	if !ok {
+	roomID := msgData.RoomID
+	if roomID == "" || msgData.Content == nil {
 		return nil
 	}
 
 	req := &models.CreateMessageRequest{
-		Content: content,
-	}
-
-	if meta, ok := msgData["meta"].(string); ok {
-		req.Meta = meta
+		Content: *msgData.Content,
+		Meta:    metaText(msgData.Meta),
 	}
 
 	message, err := h.messageSvc.SendMessage(tenantID, roomID, userID, req)
@@ -202,71 +272,159 @@ func (h *Handler) handleSendMessage(tenantID, userID string, data interface{}) e
 	}
 
 	// Broadcast to realtime subscribers
-	h.realtimeSvc.BroadcastToRoom(tenantID, roomID, map[string]interface{}{
-		"type":       "message",
-		"room_id":    roomID,
-		"seq":        message.Seq,
-		"message_id": message.MessageID,
-		"sender_id":  message.SenderID,
-		"content":    message.Content,
-		"created_at": message.CreatedAt.Format("2006-01-02T15:04:05Z07:00"),
-	})
+	h.realtimeSvc.BroadcastToRoom(tenantID, roomID, models.NewMessageEvent(message))
 
 	return nil
 }
 
 // handleAck handles acknowledgment of message delivery
-func (h *Handler) handleAck(tenantID, userID string, data interface{}) error {
-	ackData, ok := data.(map[string]interface{})
-	if !ok {
+func (h *Handler) handleAck(tenantID, userID string, data json.RawMessage) error {
+	// A command without a payload has nothing to act on
+	if len(data) == 0 {
 		return nil
 	}
 
-	roomID, ok := ackData["room_id"].(string)
-	if !ok {
+	var ackData models.WSAck
+	if err := json.Unmarshal(data, &ackData); err != nil {
+		return fmt.Errorf("invalid ack payload: %w", err)
+	}
+
+	if ackData.RoomID == "" || ackData.Seq == nil {
 		return nil
 	}
+	roomID, seq := ackData.RoomID, int(*ackData.Seq)
 
-	seqFloat, ok := ackData["seq"].(float64)
-	if !ok {
+	// Clients ack as they scroll, so keep only the highest seq per room and
+	// store and broadcast it once the burst settles
+	key := ackKey{tenantID: tenantID, userID: userID, roomID: roomID}
+
+	h.acksMu.Lock()
+	defer h.acksMu.Unlock()
+
+	if pending, scheduled := h.pendingAcks[key]; scheduled {
+		if seq > pending.seq {
+			pending.seq = seq
+		}
 		return nil
 	}
-	seq := int(seqFloat)
 
-	if err := h.messageSvc.UpdateLastAck(tenantID, userID, roomID, seq); err != nil {
-		return err
+	h.pendingAcks[key] = &pendingAck{
+		seq:   seq,
+		timer: time.AfterFunc(ackDebounce, func() { h.flushAck(key) }),
+	}
+
+	return nil
+}
+
+// FlushAcks stores and broadcasts every pending ack right away. It is called
+// on shutdown so acks still waiting out the debounce aren't lost.
+func (h *Handler) FlushAcks() {
+	h.acksMu.Lock()
+	keys := make([]ackKey, 0, len(h.pendingAcks))
+	for key, pending := range h.pendingAcks {
+		pending.timer.Stop()
+		keys = append(keys, key)
+	}
+	h.acksMu.Unlock()
+
+	for _, key := range keys {
+		h.flushAck(key)
+	}
+}
+
+// flushAck stores a user's pending ack for a room and broadcasts it
+func (h *Handler) flushAck(key ackKey) {
+	h.acksMu.Lock()
+	pending, exists := h.pendingAcks[key]
+	delete(h.pendingAcks, key)
+	h.acksMu.Unlock()
+
+	// A timer that fired while FlushAcks ran finds its ack already stored
+	if !exists {
+		return
+	}
+	seq := pending.seq
+
+	if err := h.messageSvc.UpdateLastAck(key.tenantID, key.userID, key.roomID, seq); err != nil {
+		slog.Error("Failed to store ack",
+			"tenant_id", key.tenantID,
+			"user_id", key.userID,
+			"room_id", key.roomID,
+			"seq", seq,
+			"error", err)
+		return
 	}
 
 	// Broadcast ACK to other room members
-	h.realtimeSvc.BroadcastToRoom(tenantID, roomID, map[string]interface{}{
-		"type":    "ack.received",
-		"room_id": roomID,
-		"seq":     seq,
-		"user_id": userID,
+	h.realtimeSvc.BroadcastToRoom(key.tenantID, key.roomID, &models.WSAckEvent{
+		Type:   "ack.received",
+		RoomID: key.roomID,
+		Seq:    seq,
+		UserID: key.userID,
 	})
-
-	return nil
 }
 
-// handleTyping handles typing indicators
-func (h *Handler) handleTyping(tenantID, userID string, data interface{}, action string) error {
-	typingData, ok := data.(map[string]interface{})
-	if !ok {
+// handleTyping handles typing indicators. Clients typically send start on
+// every keystroke, so repeats within typingInterval are dropped; stop always
+// goes through so indicators never get stuck.
+func (h *Handler) handleTyping(tenantID, userID string, lastTyping map[string]time.Time, data json.RawMessage, action string) error {
+	// A command without a payload has nothing to act on
+	if len(data) == 0 {
 		return nil
 	}
 
-	roomID, ok := typingData["room_id"].(string)
-	if !ok {
+	var typingData models.WSTyping
+	if err := json.Unmarshal(data, &typingData); err != nil {
+		return fmt.Errorf("invalid typing payload: %w", err)
+	}
+
+	roomID := typingData.RoomID
+	if roomID == "" {
 		return nil
 	}
 
-	// Broadcast typing indicator to room members
-	h.realtimeSvc.BroadcastToRoom(tenantID, roomID, map[string]interface{}{
-		"type":    "typing",
-		"room_id": roomID,
-		"user_id": userID,
-		"action":  action,
+	if action == "start" {
+		now := time.Now()
+		if last, exists := lastTyping[roomID]; exists && now.Sub(last) < typingInterval {
+			return nil
+		}
+		lastTyping[roomID] = now
+	} else {
+		delete(lastTyping, roomID)
+	}
+
+	// Broadcast typing indicator to the other room members
+	h.realtimeSvc.BroadcastToRoomExcept(tenantID, roomID, userID, &models.WSTypingEvent{
+		Type:   "typing",
+		RoomID: roomID,
+		UserID: userID,
+		Action: action,
 	})
 
 	return nil
-}
\ No newline at end of file
+}
+
+// metaText returns message metadata as the JSON text that is stored. Clients
+// send it either as an object or as a string already holding the JSON.
+func metaText(meta json.RawMessage) string {
+	if len(meta) == 0 || string(meta) == "null" {
+		return ""
+	}
+
+	var text string
+	if err := json.Unmarshal(meta, &text); err == nil {
+		return text
+	}
+	return string(meta)
+}
+
+// truncate shortens s to at most n bytes without splitting a UTF-8 sequence
+func truncate(s string, n int) string {
+	if len(s) <= n {
+		return s
+	}
+	for n > 0 && !utf8.RuneStart(s[n]) {
+		n--
+	}
+	return s[:n]
+}
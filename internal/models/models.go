@@ -1,6 +1,10 @@
 package models
 
-import "time"
+import (
+	"encoding/json"
+	"sync/atomic"
+	"time"
+)
 
 // Tenant represents a tenant in the system
 type Tenant struct {
@@ -127,21 +131,116 @@ type NotificationTargets struct {
 
 // WSMessage represents a WebSocket message
 type WSMessage struct {
-	Type string      `json:"type"`
-	Data interface{} `json:"data,omitempty"`
+	Type string          `json:"type"`
+	Data json.RawMessage `json:"data,omitempty"` // decoded once the type is known
+}
+
+// WSMessageEvent is the "message" event pushed to clients for a stored message
+type WSMessageEvent struct {
+	Type      string `json:"type"`
+	RoomID    string `json:"room_id"`
+	Seq       int    `json:"seq"`
+	MessageID string `json:"message_id"`
+	SenderID  string `json:"sender_id"`
+	Content   string `json:"content"`
+	Meta      string `json:"meta,omitempty"`
+	CreatedAt string `json:"created_at"`
+}
+
+// NewMessageEvent builds the realtime event for a message
+func NewMessageEvent(msg *Message) *WSMessageEvent {
+	return &WSMessageEvent{
+		Type:      "message",
+		RoomID:    msg.ChatroomID,
+		Seq:       msg.Seq,
+		MessageID: msg.MessageID,
+		SenderID:  msg.SenderID,
+		Content:   msg.Content,
+		Meta:      msg.Meta,
+		CreatedAt: formatRFC3339(msg.CreatedAt),
+	}
+}
+
+// formattedSecond is a timestamp already formatted for one second and zone
+type formattedSecond struct {
+	unix int64
+	loc  *time.Location
+	text string
+}
+
+// lastFormatted holds the most recently formatted second. Messages stored
+// together share a timestamp, so batches and busy rooms mostly reuse it.
+var lastFormatted atomic.Pointer[formattedSecond]
+
+// formatRFC3339 formats t as RFC 3339, reusing the previous result when t
+// falls in the same second and zone
+func formatRFC3339(t time.Time) string {
+	unix, loc := t.Unix(), t.Location()
+	if cached := lastFormatted.Load(); cached != nil && cached.unix == unix && cached.loc == loc {
+		return cached.text
+	}
+
+	text := t.Format(time.RFC3339)
+	lastFormatted.Store(&formattedSecond{unix: unix, loc: loc, text: text})
+	return text
+}
+
+// WSMessageBatch delivers several queued messages to a client in one frame
+type WSMessageBatch struct {
+	Type     string            `json:"type"`
+	Messages []WSMessageEvent `json:"messages"`
+}
+
+// WSPresenceEvent announces that a user came online or went offline
+type WSPresenceEvent struct {
+	Type      string `json:"type"`
+	UserID    string `json:"user_id"`
+	Status    string `json:"status"`
+	Timestamp int64  `json:"timestamp"`
+}
+
+// WSPresenceBatch carries several presence changes in one frame
+type WSPresenceBatch struct {
+	Type    string             `json:"type"`
+	Updates []*WSPresenceEvent `json:"updates"`
+}
+
+// WSNotificationEvent delivers a tenant notification to connected users
+type WSNotificationEvent struct {
+	Type           string `json:"type"`
+	NotificationID string `json:"notification_id"`
+	Topic          string `json:"topic"`
+	Payload        string `json:"payload"`
+	Timestamp      int64  `json:"timestamp"`
+}
+
+// WSAckEvent tells room members that a user acknowledged messages up to seq
+type WSAckEvent struct {
+	Type   string `json:"type"`
+	RoomID string `json:"room_id"`
+	Seq    int    `json:"seq"`
+	UserID string `json:"user_id"`
+}
+
+// WSTypingEvent tells room members that a user started or stopped typing
+type WSTypingEvent struct {
+	Type   string `json:"type"`
+	RoomID string `json:"room_id"`
+	UserID string `json:"user_id"`
+	Action string `json:"action"`
 }
 
 // WSMessageSend represents a send message command
 type WSMessageSend struct {
-	RoomID  string `json:"room_id"`
-	Content string `json:"content"`
-	Meta    string `json:"meta,omitempty"`
+	RoomID  string          `json:"room_id"`
+	Content *string         `json:"content"` // nil when the field is missing
+	Meta    json.RawMessage `json:"meta,omitempty"` // JSON object, or a string holding one
 }
 
 // WSAck represents an acknowledgment
 type WSAck struct {
-	RoomID string `json:"room_id"`
-	Seq    int    `json:"seq"`
+	RoomID string   `json:"room_id"`
+	Seq    *float64 `json:"seq"` // nil when missing; clients may send floats such as 5.0
 }
 
 // WSTyping represents a typing indicator
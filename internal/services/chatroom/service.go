@@ -5,6 +5,7 @@ import (
 	"fmt"
 	"log/slog"
 	"sort"
+	"strings"
 
 	"github.com/hastenr/chatapi/internal/models"
 	"github.com/google/uuid"
@@ -139,6 +140,10 @@ func (s *Service) createGroupRoom(tenantID string, req *models.CreateRoomRequest
 	return room, nil
 }
 
+// maxMembersPerInsert keeps a multi-row member insert well under SQLite's
+// bound parameter limit
+const maxMembersPerInsert = 300
+
 // addMembers adds members to a room
 func (s *Service) addMembers(tenantID, roomID string, userIDs []string) error {
 	if len(userIDs) == 0 {
@@ -152,15 +157,26 @@ func (s *Service) addMembers(tenantID, roomID string, userIDs []string) error {
 	}
 	defer tx.Rollback()
 
-	query := `
-		INSERT INTO room_members (chatroom_id, tenant_id, user_id, role)
-		VALUES (?, ?, ?, 'member')
-	`
+	// Insert members with one multi-row statement per chunk rather than one
+	// statement per member
+	for start := 0; start < len(userIDs); start += maxMembersPerInsert {
+		end := start + maxMembersPerInsert
+		if end > len(userIDs) {
+			end = len(userIDs)
+		}
+		chunk := userIDs[start:end]
 
-	for _, userID := range userIDs {
-		_, err = tx.Exec(query, roomID, tenantID, userID)
-		if err != nil {
-			return fmt.Errorf("failed to add member %s: %w", userID, err)
+		query := `
+			INSERT INTO room_members (chatroom_id, tenant_id, user_id, role)
+			VALUES ` + strings.Repeat("(?, ?, ?, 'member'), ", len(chunk)-1) + `(?, ?, ?, 'member')`
+
+		args := make([]interface{}, 0, len(chunk)*3)
+		for _, userID := range chunk {
+			args = append(args, roomID, tenantID, userID)
+		}
+
+		if _, err := tx.Exec(query, args...); err != nil {
+			return fmt.Errorf("failed to add members: %w", err)
 		}
 	}
 
@@ -4,6 +4,9 @@ import (
 	"database/sql"
 	"fmt"
 	"log/slog"
+	"sort"
+	"strings"
+	"sync"
 	"time"
 
 	"github.com/hastenr/chatapi/internal/models"
@@ -12,102 +15,223 @@ import (
 
 // Service handles message and notification delivery with retries
 type Service struct {
-	db          *sql.DB
-	realtimeSvc *realtime.Service
-	maxAttempts int
+	db            *sql.DB
+	realtimeSvc   *realtime.Service
+	maxAttempts   int
+	retryInterval time.Duration
+
+	// deliveryLocks serializes queued message delivery per tenant, so the
+	// worker and a reconnect sync never send the same rows
+	deliveryLocks sync.Map // map[string]*sync.Mutex
 }
 
-// NewService creates a new delivery service
-func NewService(db *sql.DB, realtimeSvc *realtime.Service) *Service {
+// NewService creates a new delivery service. A queued message that could not
+// be delivered waits retryInterval before its next attempt, doubling after
+// each further failure, and is given up after maxAttempts.
+func NewService(db *sql.DB, realtimeSvc *realtime.Service, maxAttempts int, retryInterval time.Duration) *Service {
 	return &Service{
-		db:          db,
-		realtimeSvc: realtimeSvc,
-		maxAttempts: 5,
+		db:            db,
+		realtimeSvc:   realtimeSvc,
+		maxAttempts:   maxAttempts,
+		retryInterval: retryInterval,
 	}
 }
 
+// deliveryLock returns the lock guarding a tenant's queued message delivery
+func (s *Service) deliveryLock(tenantID string) *sync.Mutex {
+	if lock, exists := s.deliveryLocks.Load(tenantID); exists {
+		return lock.(*sync.Mutex)
+	}
+	lock, _ := s.deliveryLocks.LoadOrStore(tenantID, &sync.Mutex{})
+	return lock.(*sync.Mutex)
+}
+
+// pendingDelivery is a queued delivery together with the message it refers to
+type pendingDelivery struct {
+	queued  models.UndeliveredMessage
+	message models.Message
+}
+
 // ProcessUndeliveredMessages processes messages that haven't been delivered yet
 func (s *Service) ProcessUndeliveredMessages(tenantID string, limit int) error {
 	if limit <= 0 || limit > 100 {
 		limit = 50
 	}
 
+	// Rows are loaded, sent and marked under the tenant's lock
+	lock := s.deliveryLock(tenantID)
+	lock.Lock()
+	defer lock.Unlock()
+
+	// Join in the message itself so delivery needs no per-message lookups.
+	// Messages still backing off from a failed attempt are left for a later
+	// pass rather than retried, and counted, on every one.
 	query := `
-		SELECT id, tenant_id, user_id, chatroom_id, message_id, seq, attempts
-		FROM undelivered_messages
-		WHERE tenant_id = ? AND attempts < ?
-		ORDER BY created_at ASC
+		SELECT u.id, u.tenant_id, u.user_id, u.chatroom_id, u.message_id, u.seq, u.attempts,
+			m.sender_id, m.content, m.meta, m.created_at
+		FROM undelivered_messages u
+		JOIN messages m ON m.tenant_id = u.tenant_id AND m.message_id = u.message_id
+		WHERE u.tenant_id = ? AND u.attempts < ?
+			AND (u.last_attempt_at IS NULL
+				OR u.last_attempt_at <= datetime('now', '-' || (? << (u.attempts - 1)) || ' seconds'))
+		ORDER BY u.created_at ASC
 		LIMIT ?
 	`
 
-	rows, err := s.db.Query(query, tenantID, s.maxAttempts, limit)
+	retrySeconds := int64(s.retryInterval / time.Second)
+	batch, err := s.loadPending(query, tenantID, s.maxAttempts, retrySeconds, limit)
 	if err != nil {
-		return fmt.Errorf("failed to get undelivered messages: %w", err)
+		return err
 	}
-	defer rows.Close()
 
-	for rows.Next() {
-		var msg models.UndeliveredMessage
-		err := rows.Scan(
-			&msg.ID,
-			&msg.TenantID,
-			&msg.UserID,
-			&msg.ChatroomID,
-			&msg.MessageID,
-			&msg.Seq,
-			&msg.Attempts,
-		)
-		if err != nil {
-			slog.Error("Failed to scan undelivered message", "error", err)
+	// Order the batch by recipient, keeping each user's messages in queue
+	// order, so every user's messages are one contiguous run that goes out
+	// as a single frame
+	sort.SliceStable(batch, func(i, j int) bool {
+		return batch[i].queued.UserID < batch[j].queued.UserID
+	})
+
+	var deliveredIDs, retryIDs []int
+	for start := 0; start < len(batch); {
+		userID := batch[start].queued.UserID
+		end := start + 1
+		for end < len(batch) && batch[end].queued.UserID == userID {
+			end++
+		}
+		msgs := batch[start:end]
+		start = end
+
+		// The send itself reports whether the user was reachable, so there is
+		// no separate online check
+		if sent := s.deliverToUser(tenantID, userID, msgs); sent != nil {
+			deliveredIDs = append(deliveredIDs, sent...)
 			continue
 		}
 
-		if err := s.attemptMessageDelivery(&msg); err != nil {
-			slog.Warn("Failed to deliver message",
-				"tenant_id", tenantID,
-				"message_id", msg.MessageID,
-				"user_id", msg.UserID,
-				"attempts", msg.Attempts,
-				"error", err)
+		// User is offline, count an attempt against each message
+		for i := range msgs {
+			retryIDs = append(retryIDs, msgs[i].queued.ID)
 		}
 	}
 
+	// Record attempts and remove everything that was sent, one statement each
+	if err := s.incrementMessageAttempts(retryIDs); err != nil {
+		return fmt.Errorf("failed to increment delivery attempts: %w", err)
+	}
+	if err := s.markMessagesDelivered(deliveredIDs); err != nil {
+		return fmt.Errorf("failed to mark messages delivered: %w", err)
+	}
+
 	return nil
 }
 
-// attemptMessageDelivery tries to deliver a message to a user
-func (s *Service) attemptMessageDelivery(msg *models.UndeliveredMessage) error {
-	// Check if user is online
-	if s.realtimeSvc.IsUserOnline(msg.TenantID, msg.UserID) {
-		// Get the full message to send
-		fullMsg, err := s.getMessage(msg.TenantID, msg.MessageID)
-		if err != nil {
-			return fmt.Errorf("failed to get message: %w", err)
-		}
+// DeliverPendingToUser sends a user's queued messages right away, typically
+// when they reconnect, instead of waiting for the next worker pass
+func (s *Service) DeliverPendingToUser(tenantID, userID string) error {
+	// Waits out a worker pass in progress, so rows it sent are already gone
+	lock := s.deliveryLock(tenantID)
+	lock.Lock()
+	defer lock.Unlock()
 
-		// Send via WebSocket
-		messagePayload := map[string]interface{}{
-			"type":       "message",
-			"room_id":    msg.ChatroomID,
-			"seq":        msg.Seq,
-			"message_id": msg.MessageID,
-			"sender_id":  fullMsg.SenderID,
-			"content":    fullMsg.Content,
-			"created_at": fullMsg.CreatedAt.Format(time.RFC3339),
-		}
+	query := `
+		SELECT u.id, u.tenant_id, u.user_id, u.chatroom_id, u.message_id, u.seq, u.attempts,
+			m.sender_id, m.content, m.meta, m.created_at
+		FROM undelivered_messages u
+		JOIN messages m ON m.tenant_id = u.tenant_id AND m.message_id = u.message_id
+		WHERE u.tenant_id = ? AND u.user_id = ? AND u.attempts < ?
+		ORDER BY u.chatroom_id, u.seq ASC
+		LIMIT 100
+	`
+
+	msgs, err := s.loadPending(query, tenantID, userID, s.maxAttempts)
+	if err != nil {
+		return err
+	}
+	if len(msgs) == 0 {
+		return nil
+	}
+
+	if err := s.markMessagesDelivered(s.deliverToUser(tenantID, userID, msgs)); err != nil {
+		return fmt.Errorf("failed to mark messages delivered: %w", err)
+	}
 
-		if fullMsg.Meta != "" {
-			messagePayload["meta"] = fullMsg.Meta
+	return nil
+}
+
+// loadPending runs a queue query joined with messages and reads the whole
+// result before returning: the pool holds a single connection, which stays
+// busy until rows is closed. Rows are scanned into one backing array rather
+// than allocated one by one.
+func (s *Service) loadPending(query string, args ...interface{}) ([]pendingDelivery, error) {
+	rows, err := s.db.Query(query, args...)
+	if err != nil {
+		return nil, fmt.Errorf("failed to get undelivered messages: %w", err)
+	}
+	defer rows.Close()
+
+	var batch []pendingDelivery
+	for rows.Next() {
+		batch = append(batch, pendingDelivery{})
+		p := &batch[len(batch)-1]
+		err := rows.Scan(
+			&p.queued.ID,
+			&p.queued.TenantID,
+			&p.queued.UserID,
+			&p.queued.ChatroomID,
+			&p.queued.MessageID,
+			&p.queued.Seq,
+			&p.queued.Attempts,
+			&p.message.SenderID,
+			&p.message.Content,
+			&p.message.Meta,
+			&p.message.CreatedAt,
+		)
+		if err != nil {
+			slog.Error("Failed to scan undelivered message", "error", err)
+			batch = batch[:len(batch)-1]
+			continue
 		}
+		p.message.MessageID = p.queued.MessageID
+		p.message.TenantID = p.queued.TenantID
+		p.message.ChatroomID = p.queued.ChatroomID
+		p.message.Seq = p.queued.Seq
+	}
+	if err := rows.Err(); err != nil {
+		return nil, fmt.Errorf("failed to read undelivered messages: %w", err)
+	}
 
-		s.realtimeSvc.SendToUser(msg.TenantID, msg.UserID, messagePayload)
+	return batch, nil
+}
 
-		// Mark as delivered
-		return s.markMessageDelivered(msg.ID)
+// deliverToUser sends a user's queued messages in one frame and returns the
+// queue IDs of the messages that were sent, or nil if no connection took them
+func (s *Service) deliverToUser(tenantID, userID string, msgs []pendingDelivery) []int {
+	// Events are stored by value so the whole batch shares one allocation
+	events := make([]models.WSMessageEvent, len(msgs))
+	ids := make([]int, len(msgs))
+	for i := range msgs {
+		events[i] = *models.NewMessageEvent(&msgs[i].message)
+		ids[i] = msgs[i].queued.ID
 	}
 
-	// User is offline, increment attempts
-	return s.incrementMessageAttempts(msg.ID)
+	var sent int
+	switch len(events) {
+	case 0:
+		return nil
+	case 1:
+		sent = s.realtimeSvc.SendToUser(tenantID, userID, &events[0])
+	default:
+		// Send via WebSocket as a single batch frame
+		sent = s.realtimeSvc.SendToUser(tenantID, userID, &models.WSMessageBatch{
+			Type:     "messages.batch",
+			Messages: events,
+		})
+	}
+
+	if sent == 0 {
+		return nil
+	}
+	return ids
 }
 
 // ProcessNotifications processes pending notifications
@@ -124,12 +248,56 @@ func (s *Service) ProcessNotifications(tenantID string, limit int) error {
 		LIMIT ?
 	`
 
-	rows, err := s.db.Query(query, tenantID, s.maxAttempts, limit)
+	notifications, err := s.loadNotifications(query, tenantID, s.maxAttempts, limit)
 	if err != nil {
-		return fmt.Errorf("failed to get pending notifications: %w", err)
+		return err
+	}
+
+	if len(notifications) == 0 {
+		return nil
+	}
+
+	// One timestamp stamps the whole pass; start times the sends
+	start := time.Now()
+	now := start.Unix()
+
+	// The batch belongs to one tenant, so its recipients are looked up once
+	onlineUsers := s.realtimeSvc.GetOnlineUsers(tenantID)
+
+	deliveredIDs := make([]string, 0, len(notifications))
+	connections := 0
+	for _, notif := range notifications {
+		connections += s.attemptNotificationDelivery(notif, onlineUsers, now)
+		deliveredIDs = append(deliveredIDs, notif.NotificationID)
+	}
+	elapsed := time.Since(start)
+
+	// Mark the batch delivered in one statement (simplified - in reality,
+	// you'd track per-user delivery)
+	if err := s.markNotificationsDelivered(deliveredIDs); err != nil {
+		return fmt.Errorf("failed to mark notifications delivered: %w", err)
+	}
+
+	slog.Debug("Processed notifications",
+		"tenant_id", tenantID,
+		"count", len(deliveredIDs),
+		"connections", connections,
+		"send_duration_ms", elapsed.Milliseconds())
+
+	return nil
+}
+
+// loadNotifications reads every notification matched by query before
+// returning, so the single pooled connection is free for the updates that
+// follow
+func (s *Service) loadNotifications(query string, args ...interface{}) ([]*models.Notification, error) {
+	rows, err := s.db.Query(query, args...)
+	if err != nil {
+		return nil, fmt.Errorf("failed to get pending notifications: %w", err)
 	}
 	defer rows.Close()
 
+	var notifications []*models.Notification
 	for rows.Next() {
 		var notif models.Notification
 		err := rows.Scan(
@@ -143,46 +311,41 @@ func (s *Service) ProcessNotifications(tenantID string, limit int) error {
 			slog.Error("Failed to scan notification", "error", err)
 			continue
 		}
-
-		if err := s.attemptNotificationDelivery(&notif); err != nil {
-			slog.Warn("Failed to deliver notification",
-				"tenant_id", tenantID,
-				"notification_id", notif.NotificationID,
-				"topic", notif.Topic,
-				"attempts", notif.Attempts,
-				"error", err)
-		}
+		notifications = append(notifications, &notif)
+	}
+	if err := rows.Err(); err != nil {
+		return nil, fmt.Errorf("failed to read pending notifications: %w", err)
 	}
 
-	return nil
+	return notifications, nil
 }
 
-// attemptNotificationDelivery tries to deliver a notification
-func (s *Service) attemptNotificationDelivery(notif *models.Notification) error {
+// attemptNotificationDelivery sends a notification to the tenant's online users
+// and returns how many connections it reached
+func (s *Service) attemptNotificationDelivery(notif *models.Notification, onlineUsers []string, timestamp int64) int {
 	// For now, broadcast to all online users in the tenant
 	// In a more sophisticated implementation, you'd look up subscribers
 	// and send to specific users or endpoints
 
-	notificationPayload := map[string]interface{}{
-		"type":            "notification",
-		"notification_id": notif.NotificationID,
-		"topic":           notif.Topic,
-		"payload":         notif.Payload,
-		"timestamp":       time.Now().Unix(),
+	notificationPayload := &models.WSNotificationEvent{
+		Type:           "notification",
+		NotificationID: notif.NotificationID,
+		Topic:          notif.Topic,
+		Payload:        notif.Payload,
+		Timestamp:      timestamp,
 	}
 
-	// Get online users and send to them
-	onlineUsers := s.realtimeSvc.GetOnlineUsers(notif.TenantID)
-	for _, userID := range onlineUsers {
-		s.realtimeSvc.SendToUser(notif.TenantID, userID, notificationPayload)
-	}
-
-	// Mark as delivered (simplified - in reality, you'd track per-user delivery)
-	return s.markNotificationDelivered(notif.NotificationID)
+	// Send to the online users; the payload is encoded once for all
+	return s.realtimeSvc.SendToUsers(notif.TenantID, onlineUsers, notificationPayload)
 }
 
-// CleanupOldEntries removes old delivered entries to prevent unbounded growth
-func (s *Service) CleanupOldEntries(tenantID string, maxAge time.Duration) error {
+// cleanupBatchSize caps how many rows one cleanup statement deletes, so a
+// large backlog doesn't hold the database's write lock in one long statement
+const cleanupBatchSize = 1000
+
+// CleanupOldEntries removes old entries across all tenants to prevent
+// unbounded growth
+func (s *Service) CleanupOldEntries(maxAge time.Duration) error {
 	cutoffTime := time.Now().Add(-maxAge)
 
 	// Clean up old undelivered messages that are marked as delivered
@@ -191,10 +354,14 @@ func (s *Service) CleanupOldEntries(tenantID string, maxAge time.Duration) error
 	// For now, just clean up very old undelivered messages that have exceeded max attempts
 	query := `
 		DELETE FROM undelivered_messages
-		WHERE tenant_id = ? AND attempts >= ? AND created_at < ?
+		WHERE id IN (
+			SELECT id FROM undelivered_messages
+			WHERE attempts >= ? AND created_at < ?
+			LIMIT ?
+		)
 	`
 
-	_, err := s.db.Exec(query, tenantID, s.maxAttempts, cutoffTime)
+	messages, err := s.deleteInBatches(query, s.maxAttempts, cutoffTime)
 	if err != nil {
 		return fmt.Errorf("failed to cleanup old undelivered messages: %w", err)
 	}
@@ -202,71 +369,106 @@ func (s *Service) CleanupOldEntries(tenantID string, maxAge time.Duration) error
 	// Clean up old dead notifications
 	notifQuery := `
 		DELETE FROM notifications
-		WHERE tenant_id = ? AND status = 'dead' AND created_at < ?
+		WHERE rowid IN (
+			SELECT rowid FROM notifications
+			WHERE status = 'dead' AND created_at < ?
+			LIMIT ?
+		)
 	`
 
-	_, err = s.db.Exec(notifQuery, tenantID, cutoffTime)
+	notifications, err := s.deleteInBatches(notifQuery, cutoffTime)
 	if err != nil {
 		return fmt.Errorf("failed to cleanup old notifications: %w", err)
 	}
 
-	slog.Info("Cleaned up old delivery entries",
-		"tenant_id", tenantID,
-		"max_age", maxAge)
+	if messages > 0 || notifications > 0 {
+		slog.Info("Cleaned up old delivery entries",
+			"undelivered_messages", messages,
+			"notifications", notifications,
+			"max_age", maxAge)
+	}
 
 	return nil
 }
 
-// Helper methods
+// deleteInBatches runs a DELETE whose last parameter is a LIMIT until it
+// removes fewer than cleanupBatchSize rows, returning the total removed
+func (s *Service) deleteInBatches(query string, args ...interface{}) (int64, error) {
+	args = append(args, cleanupBatchSize)
 
-func (s *Service) getMessage(tenantID, messageID string) (*models.Message, error) {
-	var msg models.Message
-	query := `
-		SELECT message_id, tenant_id, chatroom_id, sender_id, seq, content, meta, created_at
-		FROM messages
-		WHERE tenant_id = ? AND message_id = ?
-	`
+	var total int64
+	for {
+		result, err := s.db.Exec(query, args...)
+		if err != nil {
+			return total, err
+		}
 
-	err := s.db.QueryRow(query, tenantID, messageID).Scan(
-		&msg.MessageID,
-		&msg.TenantID,
-		&msg.ChatroomID,
-		&msg.SenderID,
-		&msg.Seq,
-		&msg.Content,
-		&msg.Meta,
-		&msg.CreatedAt,
-	)
+		deleted, err := result.RowsAffected()
+		if err != nil {
+			return total, err
+		}
+		total += deleted
 
-	if err != nil {
-		return nil, err
+		if deleted < cleanupBatchSize {
+			return total, nil
+		}
 	}
-
-	return &msg, nil
 }
 
-func (s *Service) markMessageDelivered(id int) error {
-	query := `DELETE FROM undelivered_messages WHERE id = ?`
-	_, err := s.db.Exec(query, id)
+// Helper methods
+
+func (s *Service) markMessagesDelivered(ids []int) error {
+	if len(ids) == 0 {
+		return nil
+	}
+
+	query := `DELETE FROM undelivered_messages WHERE id IN (` + placeholders(len(ids)) + `)`
+	args := make([]interface{}, len(ids))
+	for i, id := range ids {
+		args[i] = id
+	}
+
+	_, err := s.db.Exec(query, args...)
 	return err
 }
 
-func (s *Service) incrementMessageAttempts(id int) error {
+func (s *Service) incrementMessageAttempts(ids []int) error {
+	if len(ids) == 0 {
+		return nil
+	}
+
 	query := `
 		UPDATE undelivered_messages
 		SET attempts = attempts + 1, last_attempt_at = CURRENT_TIMESTAMP
-		WHERE id = ?
-	`
-	_, err := s.db.Exec(query, id)
+		WHERE id IN (` + placeholders(len(ids)) + `)`
+	args := make([]interface{}, len(ids))
+	for i, id := range ids {
+		args[i] = id
+	}
+
+	_, err := s.db.Exec(query, args...)
 	return err
 }
 
-func (s *Service) markNotificationDelivered(notificationID string) error {
+func (s *Service) markNotificationsDelivered(notificationIDs []string) error {
+	if len(notificationIDs) == 0 {
+		return nil
+	}
+
 	query := `
 		UPDATE notifications
 		SET status = 'delivered', last_attempt_at = CURRENT_TIMESTAMP
-		WHERE notification_id = ?
-	`
-	_, err := s.db.Exec(query, notificationID)
+		WHERE notification_id IN (` + placeholders(len(notificationIDs)) + `)`
+	args := make([]interface{}, len(notificationIDs))
+	for i, id := range notificationIDs {
+		args[i] = id
+	}
+
+	_, err := s.db.Exec(query, args...)
 	return err
 }
+
+// placeholders returns a comma-separated list of n bind parameters
+func placeholders(n int) string {
+	return strings.Repeat("?, ", n-1) + "?"
+}
@@ -0,0 +1,96 @@
+package message
+
+import (
+	"sync"
+	"time"
+
+	"github.com/hastenr/chatapi/internal/models"
+)
+
+// Recent history pages are cached so clients reopening a conversation don't
+// query it again; any message sent to a room drops that room's pages
+const (
+	historyCacheTTL    = 30 * time.Second
+	maxCachedRooms     = 1000
+	maxCachedRoomPages = 16
+)
+
+type historyKey struct {
+	tenantID string
+	roomID   string
+}
+
+type pageKey struct {
+	afterSeq int
+	limit    int
+}
+
+// roomHistory holds the cached pages of one room. gen changes whenever the
+// room is invalidated, so a read that raced with a send is never stored.
+type roomHistory struct {
+	gen   uint64
+	pages map[pageKey]historyPage
+}
+
+type historyPage struct {
+	messages  []*models.Message
+	expiresAt time.Time
+}
+
+// historyCache caches GetMessages results per room
+type historyCache struct {
+	mu    sync.Mutex
+	rooms map[historyKey]*roomHistory
+}
+
+func newHistoryCache() *historyCache {
+	return &historyCache{rooms: make(map[historyKey]*roomHistory)}
+}
+
+// get returns a cached page if one is fresh. On a miss it returns the room
+// entry and generation to hand back to put once the page has been loaded.
+func (c *historyCache) get(key historyKey, page pageKey) ([]*models.Message, *roomHistory, uint64, bool) {
+	c.mu.Lock()
+	defer c.mu.Unlock()
+
+	room := c.rooms[key]
+	if room == nil {
+		if len(c.rooms) >= maxCachedRooms {
+			c.rooms = make(map[historyKey]*roomHistory)
+		}
+		room = &roomHistory{pages: make(map[pageKey]historyPage)}
+		c.rooms[key] = room
+	}
+
+	if cached, exists := room.pages[page]; exists && time.Now().Before(cached.expiresAt) {
+		return cached.messages, nil, 0, true
+	}
+
+	return nil, room, room.gen, false
+}
+
+// put stores a loaded page unless the room changed while it was being read
+func (c *historyCache) put(key historyKey, page pageKey, room *roomHistory, gen uint64, messages []*models.Message) {
+	c.mu.Lock()
+	defer c.mu.Unlock()
+
+	if c.rooms[key] != room || room.gen != gen {
+		return
+	}
+
+	if len(room.pages) >= maxCachedRoomPages {
+		room.pages = make(map[pageKey]historyPage)
+	}
+	room.pages[page] = historyPage{messages: messages, expiresAt: time.Now().Add(historyCacheTTL)}
+}
+
+// invalidate drops a room's cached pages after new messages are stored
+func (c *historyCache) invalidate(key historyKey) {
+	c.mu.Lock()
+	defer c.mu.Unlock()
+
+	if room := c.rooms[key]; room != nil {
+		room.gen++
+		room.pages = make(map[pageKey]historyPage)
+	}
+}
@@ -1,87 +1,235 @@
 package message
 
 import (
+	"context"
 	"database/sql"
 	"fmt"
 	"log/slog"
 	"time"
 
+	"github.com/hastenr/chatapi/internal/db"
 	"github.com/hastenr/chatapi/internal/models"
 	"github.com/google/uuid"
 )
 
 // Service handles message operations
 type Service struct {
-	db *sql.DB
+	db      *sql.DB
+	stmts   *db.StmtCache
+	sendCh  chan *sendRequest
+	history *historyCache
 }
 
-// NewService creates a new message service
-func NewService(db *sql.DB) *Service {
-	return &Service{db: db}
+// maxSendBatch caps how many queued messages are written in one transaction
+const maxSendBatch = 50
+
+// sendRequest is a message waiting to be written by the send worker
+type sendRequest struct {
+	tenantID string
+	roomID   string
+	senderID string
+	req      *models.CreateMessageRequest
+	result   chan sendResult
 }
 
-// SendMessage stores a message transactionally with sequencing
-func (s *Service) SendMessage(tenantID, roomID, senderID string, req *models.CreateMessageRequest) (*models.Message, error) {
-	// Start transaction
-	tx, err := s.db.Begin()
-	if err != nil {
-		return nil, fmt.Errorf("failed to begin transaction: %w", err)
+type sendResult struct {
+	message *models.Message
+	err     error
+}
+
+// NewService creates a new message service
+func NewService(database *sql.DB) *Service {
+	s := &Service{
+		db:      database,
+		stmts:   db.NewStmtCache(database),
+		sendCh:  make(chan *sendRequest, maxSendBatch),
+		history: newHistoryCache(),
 	}
-	defer tx.Rollback()
 
-	// Increment room sequence
-	updateSeqQuery := `
+	// Start send worker
+	go s.sendWorker()
+
+	return s
+}
+
+// Close releases the service's prepared statements. The database itself is
+// owned and closed by the caller.
+func (s *Service) Close() error {
+	return s.stmts.Close()
+}
+
+// Queries on the message hot paths, prepared once through the statement cache
+const (
+	incrementSeqQuery = `
 		UPDATE rooms
 		SET last_seq = last_seq + 1
 		WHERE tenant_id = ? AND room_id = ?
 	`
 
-	result, err := tx.Exec(updateSeqQuery, tenantID, roomID)
-	if err != nil {
-		return nil, fmt.Errorf("failed to update room sequence: %w", err)
+	selectSeqQuery = `
+		SELECT last_seq
+		FROM rooms
+		WHERE tenant_id = ? AND room_id = ?
+	`
+
+	getMessagesQuery = `
+		SELECT message_id, tenant_id, chatroom_id, sender_id, seq, content, meta, created_at
+		FROM messages
+		WHERE tenant_id = ? AND chatroom_id = ? AND seq > ?
+		ORDER BY seq ASC
+		LIMIT ?
+	`
+
+	insertMessageQuery = `
+		INSERT INTO messages (message_id, tenant_id, chatroom_id, sender_id, seq, content, meta, created_at)
+		VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+	`
+)
+
+// SendMessage stores a message transactionally with sequencing. Concurrent
+// sends are group-committed by the send worker, so callers block until the
+// transaction containing their message has committed.
+func (s *Service) SendMessage(tenantID, roomID, senderID string, req *models.CreateMessageRequest) (*models.Message, error) {
+	r := &sendRequest{
+		tenantID: tenantID,
+		roomID:   roomID,
+		senderID: senderID,
+		req:      req,
+		result:   make(chan sendResult, 1),
 	}
 
-	rowsAffected, err := result.RowsAffected()
-	if err != nil {
-		return nil, fmt.Errorf("failed to get rows affected: %w", err)
+	s.sendCh <- r
+	res := <-r.result
+
+	return res.message, res.err
+}
+
+// sendWorker writes queued messages. While one transaction is committing,
+// new sends queue up and are written together in the next one.
+func (s *Service) sendWorker() {
+	batch := make([]*sendRequest, 0, maxSendBatch)
+
+	for r := range s.sendCh {
+		batch = append(batch[:0], r)
+
+		// Take whatever else is already waiting, without delaying the first send
+	drain:
+		for len(batch) < maxSendBatch {
+			select {
+			case next := <-s.sendCh:
+				batch = append(batch, next)
+			default:
+				break drain
+			}
+		}
+
+		s.writeBatch(batch)
 	}
+}
 
-	if rowsAffected == 0 {
-		return nil, fmt.Errorf("room not found")
+// writeBatch writes a batch of messages and delivers each caller its result
+func (s *Service) writeBatch(batch []*sendRequest) {
+	results, err := s.insertMessages(batch)
+	if err == nil {
+		for i, r := range batch {
+			r.result <- results[i]
+		}
+		return
 	}
 
-	// Get the new sequence number
-	var seq int
-	getSeqQuery := `
-		SELECT last_seq
-		FROM rooms
-		WHERE tenant_id = ? AND room_id = ?
-	`
+	// The batch transaction failed; retry each message on its own so one bad
+	// message doesn't fail the others
+	for _, r := range batch {
+		results, err := s.insertMessages([]*sendRequest{r})
+		if err != nil {
+			r.result <- sendResult{err: err}
+			continue
+		}
+		r.result <- results[0]
+	}
+}
 
-	err = tx.QueryRow(getSeqQuery, tenantID, roomID).Scan(&seq)
+// insertMessages sequences and stores messages in a single transaction.
+// A missing room fails only that message; any other error fails the batch.
+func (s *Service) insertMessages(batch []*sendRequest) ([]sendResult, error) {
+	// Prepare statements before starting the transaction: the pool holds a
+	// single connection, so preparing inside the transaction would block on it
+	updateSeqStmt, err := s.stmts.Prepare(incrementSeqQuery)
 	if err != nil {
-		return nil, fmt.Errorf("failed to get sequence number: %w", err)
+		return nil, err
+	}
+	getSeqStmt, err := s.stmts.Prepare(selectSeqQuery)
+	if err != nil {
+		return nil, err
+	}
+	insertStmt, err := s.stmts.Prepare(insertMessageQuery)
+	if err != nil {
+		return nil, err
 	}
 
-	// Generate message ID (in production, use UUID)
-	messageID := generateMessageID()
-
-	// Prepare metadata JSON
-	var metaJSON string
-	if req.Meta != "" {
-		metaJSON = req.Meta
+	// Start transaction
+	tx, err := s.db.Begin()
+	if err != nil {
+		return nil, fmt.Errorf("failed to begin transaction: %w", err)
 	}
+	defer tx.Rollback()
+
+	updateSeq := tx.Stmt(updateSeqStmt)
+	getSeq := tx.Stmt(getSeqStmt)
+	insert := tx.Stmt(insertStmt)
 
-	// Insert message
+	results := make([]sendResult, len(batch))
 	now := time.Now()
-	insertQuery := `
-		INSERT INTO messages (message_id, tenant_id, chatroom_id, sender_id, seq, content, meta, created_at)
-		VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-	`
 
-	_, err = tx.Exec(insertQuery, messageID, tenantID, roomID, senderID, seq, req.Content, metaJSON, now)
-	if err != nil {
-		return nil, fmt.Errorf("failed to insert message: %w", err)
+	for i, r := range batch {
+		// Increment room sequence
+		result, err := updateSeq.Exec(r.tenantID, r.roomID)
+		if err != nil {
+			return nil, fmt.Errorf("failed to update room sequence: %w", err)
+		}
+
+		rowsAffected, err := result.RowsAffected()
+		if err != nil {
+			return nil, fmt.Errorf("failed to get rows affected: %w", err)
+		}
+
+		if rowsAffected == 0 {
+			results[i].err = fmt.Errorf("room not found")
+			continue
+		}
+
+		// Get the new sequence number
+		var seq int
+		err = getSeq.QueryRow(r.tenantID, r.roomID).Scan(&seq)
+		if err != nil {
+			return nil, fmt.Errorf("failed to get sequence number: %w", err)
+		}
+
+		// Generate message ID (in production, use UUID)
+		messageID := generateMessageID()
+
+		// Prepare metadata JSON
+		var metaJSON string
+		if r.req.Meta != "" {
+			metaJSON = r.req.Meta
+		}
+
+		// Insert message
+		_, err = insert.Exec(messageID, r.tenantID, r.roomID, r.senderID, seq, r.req.Content, metaJSON, now)
+		if err != nil {
+			return nil, fmt.Errorf("failed to insert message: %w", err)
+		}
+
+		results[i].message = &models.Message{
+			MessageID:  messageID,
+			TenantID:   r.tenantID,
+			ChatroomID: r.roomID,
+			SenderID:   r.senderID,
+			Seq:        seq,
+			Content:    r.req.Content,
+			Meta:       metaJSON,
+			CreatedAt:  now,
+		}
 	}
 
 	// Commit transaction
@@ -89,25 +237,29 @@ func (s *Service) SendMessage(tenantID, roomID, senderID string, req *models.Cre
 		return nil, fmt.Errorf("failed to commit transaction: %w", err)
 	}
 
-	message := &models.Message{
-		MessageID:  messageID,
-		TenantID:   tenantID,
-		ChatroomID: roomID,
-		SenderID:   senderID,
-		Seq:        seq,
-		Content:    req.Content,
-		Meta:       metaJSON,
-		CreatedAt:  now,
+	// Drop cached history of every room that received a message
+	for _, res := range results {
+		if res.message != nil {
+			s.history.invalidate(historyKey{tenantID: res.message.TenantID, roomID: res.message.ChatroomID})
+		}
 	}
 
-	slog.Info("Message sent",
-		"tenant_id", tenantID,
-		"room_id", roomID,
-		"message_id", messageID,
-		"sender_id", senderID,
-		"seq", seq)
+	// Per-message logging is debug-only; skip building the records entirely otherwise
+	if ctx := context.Background(); slog.Default().Enabled(ctx, slog.LevelDebug) {
+		for _, res := range results {
+			if res.message == nil {
+				continue
+			}
+			slog.LogAttrs(ctx, slog.LevelDebug, "Message sent",
+				slog.String("tenant_id", res.message.TenantID),
+				slog.String("room_id", res.message.ChatroomID),
+				slog.String("message_id", res.message.MessageID),
+				slog.String("sender_id", res.message.SenderID),
+				slog.Int("seq", res.message.Seq))
+		}
+	}
 
-	return message, nil
+	return results, nil
 }
 
 // GetMessages retrieves messages for a room with pagination
@@ -116,31 +268,44 @@ func (s *Service) GetMessages(tenantID, roomID string, afterSeq, limit int) ([]*
 		limit = 50 // default limit
 	}
 
-	query := `
-		SELECT message_id, tenant_id, chatroom_id, sender_id, seq, content, meta, created_at
-		FROM messages
-		WHERE tenant_id = ? AND chatroom_id = ?
-	`
-
-	args := []interface{}{tenantID, roomID}
+	// Cached pages are shared between callers and must not be modified
+	key := historyKey{tenantID: tenantID, roomID: roomID}
+	page := pageKey{afterSeq: afterSeq, limit: limit}
+	cached, room, gen, found := s.history.get(key, page)
+	if found {
+		return cached, nil
+	}
 
-	if afterSeq > 0 {
-		query += " AND seq > ?"
-		args = append(args, afterSeq)
+	messages, err := s.loadMessages(tenantID, roomID, afterSeq, limit)
+	if err != nil {
+		return nil, err
 	}
 
-	query += " ORDER BY seq ASC LIMIT ?"
-	args = append(args, limit)
+	s.history.put(key, page, room, gen, messages)
 
-	rows, err := s.db.Query(query, args...)
+	return messages, nil
+}
+
+// loadMessages reads a page of a room's messages from the database
+func (s *Service) loadMessages(tenantID, roomID string, afterSeq, limit int) ([]*models.Message, error) {
+	stmt, err := s.stmts.Prepare(getMessagesQuery)
+	if err != nil {
+		return nil, err
+	}
+
+	// Sequences start at 1, so afterSeq 0 returns the room from the beginning
+	// and every page shares the same prepared statement
+	rows, err := stmt.Query(tenantID, roomID, afterSeq, limit)
 	if err != nil {
 		return nil, fmt.Errorf("failed to get messages: %w", err)
 	}
 	defer rows.Close()
 
-	var messages []*models.Message
+	// Scan the page into one backing array rather than allocating each row
+	var page []models.Message
 	for rows.Next() {
-		var msg models.Message
+		page = append(page, models.Message{})
+		msg := &page[len(page)-1]
 		err := rows.Scan(
 			&msg.MessageID,
 			&msg.TenantID,
@@ -154,7 +319,20 @@ func (s *Service) GetMessages(tenantID, roomID string, afterSeq, limit int) ([]*
 		if err != nil {
 			return nil, fmt.Errorf("failed to scan message: %w", err)
 		}
-		messages = append(messages, &msg)
+	}
+
+	if err := rows.Err(); err != nil {
+		return nil, fmt.Errorf("failed to get messages: %w", err)
+	}
+
+	if len(page) == 0 {
+		return nil, nil
+	}
+
+	// Point into the array only once it has stopped growing
+	messages := make([]*models.Message, len(page))
+	for i := range page {
+		messages[i] = &page[i]
 	}
 
 	return messages, nil
@@ -223,16 +401,23 @@ func (s *Service) UpdateLastAck(tenantID, userID, roomID string, seq int) error
 		WHERE excluded.last_ack > last_ack
 	`
 
-	_, err := s.db.Exec(query, tenantID, userID, roomID, seq)
+	stmt, err := s.stmts.Prepare(query)
+	if err != nil {
+		return err
+	}
+
+	_, err = stmt.Exec(tenantID, userID, roomID, seq)
 	if err != nil {
 		return fmt.Errorf("failed to update last ack: %w", err)
 	}
 
-	slog.Debug("Updated last ack",
-		"tenant_id", tenantID,
-		"user_id", userID,
-		"room_id", roomID,
-		"seq", seq)
+	// Acks arrive for nearly every message read; use typed attrs so a disabled
+	// debug level costs no boxing of the arguments
+	slog.LogAttrs(context.Background(), slog.LevelDebug, "Updated last ack",
+		slog.String("tenant_id", tenantID),
+		slog.String("user_id", userID),
+		slog.String("room_id", roomID),
+		slog.Int("seq", seq))
 
 	return nil
 }
@@ -1,10 +1,12 @@
 package notification
 
 import (
+	"context"
 	"database/sql"
 	"encoding/json"
 	"fmt"
 	"log/slog"
+	"strings"
 	"time"
 
 	"github.com/hastenr/chatapi/internal/models"
@@ -13,52 +15,147 @@ import (
 
 // Service handles durable notifications
 type Service struct {
-	db *sql.DB
+	db       *sql.DB
+	createCh chan *createRequest
+}
+
+// maxCreateBatch caps how many queued notifications are written in one statement
+const maxCreateBatch = 50
+
+// createRequest is a notification waiting to be written by the create worker
+type createRequest struct {
+	tenantID string
+	topic    string
+	payload  string
+	result   chan createResult
+}
+
+type createResult struct {
+	notification *models.Notification
+	err          error
 }
 
 // NewService creates a new notification service
 func NewService(db *sql.DB) *Service {
-	return &Service{db: db}
+	s := &Service{
+		db:       db,
+		createCh: make(chan *createRequest, maxCreateBatch),
+	}
+
+	// Start create worker
+	go s.createWorker()
+
+	return s
 }
 
-// CreateNotification creates a new durable notification
+// CreateNotification creates a new durable notification. Concurrent creates
+// are written together by the create worker, so callers block until the
+// statement containing their notification has completed.
 func (s *Service) CreateNotification(tenantID string, req *models.CreateNotificationRequest) (*models.Notification, error) {
-	// Generate notification ID
-	notificationID := generateNotificationID()
-
 	// Marshal payload
 	payloadJSON, err := json.Marshal(req.Payload)
 	if err != nil {
 		return nil, fmt.Errorf("failed to marshal payload: %w", err)
 	}
 
-	// Insert notification
-	query := `
-		INSERT INTO notifications (notification_id, tenant_id, topic, payload, status)
-		VALUES (?, ?, ?, ?, 'pending')
-	`
+	r := &createRequest{
+		tenantID: tenantID,
+		topic:    req.Topic,
+		payload:  string(payloadJSON),
+		result:   make(chan createResult, 1),
+	}
 
-	_, err = s.db.Exec(query, notificationID, tenantID, req.Topic, string(payloadJSON))
-	if err != nil {
-		return nil, fmt.Errorf("failed to create notification: %w", err)
+	s.createCh <- r
+	res := <-r.result
+	if res.err != nil {
+		return nil, res.err
 	}
 
-	notification := &models.Notification{
-		NotificationID: notificationID,
-		TenantID:       tenantID,
-		Topic:          req.Topic,
-		Payload:        string(payloadJSON),
-		Status:         "pending",
-		Attempts:       0,
-		CreatedAt:      time.Now(),
+	// Notifications can arrive in bursts; typed attrs avoid boxing each
+	// argument and cost nothing when info logging is disabled
+	slog.LogAttrs(context.Background(), slog.LevelInfo, "Created notification",
+		slog.String("tenant_id", tenantID),
+		slog.String("notification_id", res.notification.NotificationID),
+		slog.String("topic", req.Topic))
+
+	return res.notification, nil
+}
+
+// createWorker writes queued notifications. While one insert is running, new
+// notifications queue up and are written together in the next one.
+func (s *Service) createWorker() {
+	batch := make([]*createRequest, 0, maxCreateBatch)
+
+	for r := range s.createCh {
+		batch = append(batch[:0], r)
+
+		// Take whatever else is already waiting, without delaying the first create
+	drain:
+		for len(batch) < maxCreateBatch {
+			select {
+			case next := <-s.createCh:
+				batch = append(batch, next)
+			default:
+				break drain
+			}
+		}
+
+		s.writeBatch(batch)
+	}
+}
+
+// writeBatch writes a batch of notifications and delivers each caller its result
+func (s *Service) writeBatch(batch []*createRequest) {
+	notifications, err := s.insertNotifications(batch)
+	if err == nil {
+		for i, r := range batch {
+			r.result <- createResult{notification: notifications[i]}
+		}
+		return
+	}
+
+	// The batch insert failed; retry each notification on its own so one bad
+	// notification doesn't fail the others
+	for _, r := range batch {
+		notifications, err := s.insertNotifications([]*createRequest{r})
+		if err != nil {
+			r.result <- createResult{err: err}
+			continue
+		}
+		r.result <- createResult{notification: notifications[0]}
 	}
+}
 
-	slog.Info("Created notification",
-		"tenant_id", tenantID,
-		"notification_id", notificationID,
-		"topic", req.Topic)
+// insertNotifications stores a batch of notifications with one multi-row insert
+func (s *Service) insertNotifications(batch []*createRequest) ([]*models.Notification, error) {
+	query := `
+		INSERT INTO notifications (notification_id, tenant_id, topic, payload, status)
+		VALUES ` + strings.Repeat("(?, ?, ?, ?, 'pending'), ", len(batch)-1) + `(?, ?, ?, ?, 'pending')`
+
+	args := make([]interface{}, 0, len(batch)*4)
+	notifications := make([]*models.Notification, len(batch))
+	now := time.Now()
+
+	for i, r := range batch {
+		notificationID := generateNotificationID()
+		args = append(args, notificationID, r.tenantID, r.topic, r.payload)
+
+		notifications[i] = &models.Notification{
+			NotificationID: notificationID,
+			TenantID:       r.tenantID,
+			Topic:          r.topic,
+			Payload:        r.payload,
+			Status:         "pending",
+			Attempts:       0,
+			CreatedAt:      now,
+		}
+	}
 
-	return notification, nil
+	if _, err := s.db.Exec(query, args...); err != nil {
+		return nil, fmt.Errorf("failed to create notification: %w", err)
+	}
+
+	return notifications, nil
 }
 
 // GetPendingNotifications gets notifications ready for delivery
@@ -0,0 +1,125 @@
+package realtime
+
+import (
+	"errors"
+	"sync"
+	"time"
+
+	"github.com/gorilla/websocket"
+)
+
+const (
+	// clientSendBuffer is the number of outgoing frames queued per connection
+	clientSendBuffer = 256
+
+	// writeWait is the time allowed to write a single frame to the peer
+	writeWait = 10 * time.Second
+
+	// pingPeriod is how often the server pings an otherwise idle peer; it must
+	// be shorter than the connection's 60 second read deadline
+	pingPeriod = 30 * time.Second
+)
+
+var (
+	errClientClosed   = errors.New("client connection closed")
+	errSendBufferFull = errors.New("client send buffer full")
+)
+
+// client is a single WebSocket connection. Outgoing frames are queued and
+// written by the connection's own writer goroutine, so senders never block
+// on a slow socket and the connection only ever has one writer.
+type client struct {
+	conn      *websocket.Conn
+	send      chan []byte
+	done      chan struct{}
+	stopped   chan struct{}
+	closeOnce sync.Once
+}
+
+// newClient wraps a connection and starts its writer
+func newClient(conn *websocket.Conn) *client {
+	c := &client{
+		conn:    conn,
+		send:    make(chan []byte, clientSendBuffer),
+		done:    make(chan struct{}),
+		stopped: make(chan struct{}),
+	}
+
+	go c.writePump()
+
+	return c
+}
+
+// write queues a text frame for the connection
+func (c *client) write(data []byte) error {
+	select {
+	case <-c.done:
+		return errClientClosed
+	default:
+	}
+
+	select {
+	case c.send <- data:
+		return nil
+	default:
+		// The peer is not keeping up; drop it rather than stall the sender.
+		// Closing the socket ends the read loop, which unregisters the client.
+		c.close()
+		c.conn.Close()
+		return errSendBufferFull
+	}
+}
+
+// close stops the writer once any queued frames have been flushed
+func (c *client) close() {
+	c.closeOnce.Do(func() {
+		close(c.done)
+	})
+}
+
+// writePump writes queued frames and keepalive pings to the connection until
+// the client is closed
+func (c *client) writePump() {
+	defer close(c.stopped)
+
+	ticker := time.NewTicker(pingPeriod)
+	defer ticker.Stop()
+
+	for {
+		select {
+		case data := <-c.send:
+			if err := c.writeFrame(data); err != nil {
+				c.close()
+				return
+			}
+		case <-ticker.C:
+			if err := c.conn.WriteControl(websocket.PingMessage, nil, time.Now().Add(writeWait)); err != nil {
+				c.close()
+				return
+			}
+		case <-c.done:
+			c.flush()
+			return
+		}
+	}
+}
+
+// flush writes any frames still queued when the client was closed
+func (c *client) flush() {
+	for {
+		select {
+		case data := <-c.send:
+			if err := c.writeFrame(data); err != nil {
+				return
+			}
+		default:
+			return
+		}
+	}
+}
+
+// writeFrame writes a single text frame with a deadline
+func (c *client) writeFrame(data []byte) error {
+	c.conn.SetWriteDeadline(time.Now().Add(writeWait))
+	return c.conn.WriteMessage(websocket.TextMessage, data)
+}
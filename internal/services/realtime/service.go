@@ -1,6 +1,7 @@
 package realtime
 
 import (
+	"bytes"
 	"context"
 	"database/sql"
 	"encoding/json"
@@ -9,33 +10,140 @@ import (
 	"time"
 
 	"github.com/gorilla/websocket"
+	"github.com/hastenr/chatapi/internal/models"
 )
 
 // Service manages WebSocket connections and real-time messaging
 type Service struct {
-	mu           sync.RWMutex
-	db           *sql.DB
-	connections  map[string]map[string][]*websocket.Conn // tenant -> user -> connections
-	presence     map[string]map[string]time.Time         // tenant -> user -> last seen
-	broadcastCh  chan *broadcastMessage
-	shutdownCh   chan struct{}
-	shutdownOnce sync.Once
+	mu              sync.RWMutex
+	db              *sql.DB
+	tenants         map[string]*tenantHub // tenant -> connected users
+	broadcastCh     chan *broadcastMessage
+	presenceMu      sync.Mutex
+	pendingPresence map[string]map[string]*models.WSPresenceEvent // tenant -> user -> latest change
+	shutdownCh      chan struct{}
+	shutdownOnce    sync.Once
+}
+
+// presenceFlushInterval is how long presence changes are coalesced before
+// being sent, so reconnect storms don't fan out one frame per change
+const presenceFlushInterval = 200 * time.Millisecond
+
+// maxConnectionsPerUser bounds how many live connections a single user may hold
+const maxConnectionsPerUser = 10
+
+// tenantHub holds the connected users of a single tenant behind its own
+// lock, so connection churn in one tenant does not contend with another
+type tenantHub struct {
+	mu     sync.RWMutex
+	users  map[string]*userState // user -> connections and presence
+	online map[string]struct{}   // users with at least one live connection
+
+	cacheMu  sync.RWMutex
+	rooms    map[string]cachedUsers // room -> recently loaded member list
+	contacts map[string]cachedUsers // user -> users who share a room with them
+}
+
+// Membership lookups are cached per hub so busy rooms and presence changes
+// don't query room_members every time
+const (
+	memberCacheTTL   = 10 * time.Second
+	maxCachedEntries = 10000
+)
+
+type cachedUsers struct {
+	userIDs   []string
+	expiresAt time.Time
+}
+
+// cachedUserIDs returns a user list from one of the hub's caches while it is
+// fresh, loading and caching it otherwise. Empty lists are not cached, so a
+// room created moments later is seen at once.
+func (h *tenantHub) cachedUserIDs(cache map[string]cachedUsers, key string, load func() ([]string, error)) ([]string, error) {
+	h.cacheMu.RLock()
+	cached, exists := cache[key]
+	h.cacheMu.RUnlock()
+
+	if exists && time.Now().Before(cached.expiresAt) {
+		return cached.userIDs, nil
+	}
+
+	userIDs, err := load()
+	if err != nil {
+		return nil, err
+	}
+
+	if len(userIDs) > 0 {
+		h.cacheMu.Lock()
+		if len(cache) >= maxCachedEntries {
+			clear(cache)
+		}
+		cache[key] = cachedUsers{userIDs: userIDs, expiresAt: time.Now().Add(memberCacheTTL)}
+		h.cacheMu.Unlock()
+	}
+
+	return userIDs, nil
+}
+
+// clientsOf returns the live connections of a user. The returned slice is
+// never modified in place, so it is safe to iterate without the lock.
+func (h *tenantHub) clientsOf(userID string) []*client {
+	h.mu.RLock()
+	defer h.mu.RUnlock()
+
+	if state, exists := h.users[userID]; exists {
+		return state.clients
+	}
+	return nil
+}
+
+// recipient is a live connection resolved for delivery, with its owner
+type recipient struct {
+	userID string
+	client *client
+}
+
+// connectedRecipients resolves the live connections of the given users in a
+// single pass under the hub lock
+func (h *tenantHub) connectedRecipients(userIDs []string) []recipient {
+	h.mu.RLock()
+	defer h.mu.RUnlock()
+
+	var recipients []recipient
+	for _, userID := range userIDs {
+		state, exists := h.users[userID]
+		if !exists {
+			continue
+		}
+		for _, c := range state.clients {
+			recipients = append(recipients, recipient{userID: userID, client: c})
+		}
+	}
+	return recipients
+}
+
+// userState holds everything tracked for a single user: their live
+// connections and when they were last seen
+type userState struct {
+	clients  []*client
+	lastSeen time.Time
 }
 
 type broadcastMessage struct {
-	tenantID string
-	roomID   string
-	message  interface{}
+	tenantID     string
+	roomID       string
+	exceptUserID string // member whose connections are skipped, if any
+	payload      []byte // encoded once by the sender, shared by every recipient
 }
 
 // NewService creates a new realtime service
 func NewService(db *sql.DB) *Service {
 	s := &Service{
-		db:          db,
-		connections: make(map[string]map[string][]*websocket.Conn),
-		presence:    make(map[string]map[string]time.Time),
-		broadcastCh: make(chan *broadcastMessage, 1000), // buffered channel
-		shutdownCh:  make(chan struct{}),
+		db:              db,
+		tenants:         make(map[string]*tenantHub),
+		broadcastCh:     make(chan *broadcastMessage, 1000), // buffered channel
+		pendingPresence: make(map[string]map[string]*models.WSPresenceEvent),
+		shutdownCh:      make(chan struct{}),
 	}
 
 	// Start broadcast worker
@@ -44,82 +152,196 @@ func NewService(db *sql.DB) *Service {
 	// Start presence cleanup worker
 	go s.presenceCleanupWorker()
 
+	// Start presence flush worker
+	go s.presenceFlushWorker()
+
 	return s
 }
 
-// RegisterConnection registers a new WebSocket connection for a user
-func (s *Service) RegisterConnection(tenantID, userID string, conn *websocket.Conn) {
+// encodeBufferPool recycles encoding buffers between outgoing messages
+var encodeBufferPool = sync.Pool{
+	New: func() interface{} { return new(bytes.Buffer) },
+}
+
+// encodeMessage serializes an outgoing message to JSON. Payloads that are
+// already encoded are passed through untouched, and HTML escaping is skipped
+// since frames are consumed as JSON rather than embedded in HTML.
+func encodeMessage(message interface{}) ([]byte, error) {
+	if raw, ok := message.(json.RawMessage); ok {
+		return raw, nil
+	}
+
+	buf := encodeBufferPool.Get().(*bytes.Buffer)
+	buf.Reset()
+	defer encodeBufferPool.Put(buf)
+
+	enc := json.NewEncoder(buf)
+	enc.SetEscapeHTML(false)
+	if err := enc.Encode(message); err != nil {
+		return nil, err
+	}
+
+	// Copy out of the pooled buffer, dropping the encoder's trailing newline
+	data := make([]byte, buf.Len()-1)
+	copy(data, buf.Bytes())
+
+	return data, nil
+}
+
+// hub returns the hub for a tenant, or nil if none of its users has connected
+func (s *Service) hub(tenantID string) *tenantHub {
+	s.mu.RLock()
+	defer s.mu.RUnlock()
+
+	return s.tenants[tenantID]
+}
+
+// hubFor returns the hub for a tenant, creating it on first use
+func (s *Service) hubFor(tenantID string) *tenantHub {
+	if h := s.hub(tenantID); h != nil {
+		return h
+	}
+
 	s.mu.Lock()
 	defer s.mu.Unlock()
 
-	// Initialize tenant map if needed
-	if s.connections[tenantID] == nil {
-		s.connections[tenantID] = make(map[string][]*websocket.Conn)
+	h := s.tenants[tenantID]
+	if h == nil {
+		h = &tenantHub{
+			users:    make(map[string]*userState),
+			online:   make(map[string]struct{}),
+			rooms:    make(map[string]cachedUsers),
+			contacts: make(map[string]cachedUsers),
+		}
+		s.tenants[tenantID] = h
 	}
+	return h
+}
 
-	// Add connection
-	s.connections[tenantID][userID] = append(s.connections[tenantID][userID], conn)
+// RegisterConnection registers a new WebSocket connection for a user
+func (s *Service) RegisterConnection(tenantID, userID string, conn *websocket.Conn) {
+	h := s.hubFor(tenantID)
+	h.mu.Lock()
+	defer h.mu.Unlock()
+
+	state := h.users[userID]
+	if state == nil {
+		state = &userState{}
+		h.users[userID] = state
+	}
+
+	// At the cap, evict the oldest connection so a reconnect loop or leaked
+	// clients cannot grow a user's entry without bound. Closing the socket
+	// ends its read loop, which then unregisters it.
+	if len(state.clients) >= maxConnectionsPerUser {
+		oldest := state.clients[0]
+		oldest.close()
+		oldest.conn.Close()
+		state.clients = append([]*client(nil), state.clients[1:]...)
 
-	// Update presence
-	if s.presence[tenantID] == nil {
-		s.presence[tenantID] = make(map[string]time.Time)
+		slog.Warn("Connection limit reached, closed oldest connection",
+			"tenant_id", tenantID,
+			"user_id", userID,
+			"limit", maxConnectionsPerUser)
 	}
-	s.presence[tenantID][userID] = time.Now()
 
-	slog.Info("WebSocket connection registered",
+	// Add connection and update presence
+	state.clients = append(state.clients, newClient(conn))
+	state.lastSeen = time.Now()
+	h.online[userID] = struct{}{}
+
+	slog.Debug("WebSocket connection registered",
 		"tenant_id", tenantID,
 		"user_id", userID,
-		"total_connections", len(s.connections[tenantID][userID]))
+		"total_connections", len(state.clients))
 }
 
 // UnregisterConnection removes a WebSocket connection for a user
 func (s *Service) UnregisterConnection(tenantID, userID string, conn *websocket.Conn) {
-	s.mu.Lock()
-	defer s.mu.Unlock()
+	h := s.hub(tenantID)
+	if h == nil {
+		return
+	}
+
+	h.mu.Lock()
+	defer h.mu.Unlock()
 
-	connections, exists := s.connections[tenantID][userID]
+	state, exists := h.users[userID]
 	if !exists {
 		return
 	}
 
-	// Remove the specific connection
-	for i, c := range connections {
-		if c == conn {
-			// Remove connection from slice
-			s.connections[tenantID][userID] = append(connections[:i], connections[i+1:]...)
-			break
+	// Remove the specific connection. Build a new slice instead of shifting
+	// in place: senders iterate the slice they read after releasing the lock.
+	remaining := make([]*client, 0, len(state.clients))
+	for _, c := range state.clients {
+		if c.conn == conn {
+			c.close()
+			continue
 		}
+		remaining = append(remaining, c)
+	}
+	state.clients = remaining
+
+	if len(state.clients) == 0 {
+		delete(h.online, userID)
 	}
 
 	// If no more connections for this user, update presence with grace period
-	if len(s.connections[tenantID][userID]) == 0 {
-		delete(s.connections[tenantID], userID)
+	if len(state.clients) == 0 {
 		// Keep presence for 5 seconds to handle quick reconnects
 		time.AfterFunc(5*time.Second, func() {
-			s.mu.Lock()
-			if presenceTime, exists := s.presence[tenantID][userID]; exists {
-				if time.Since(presenceTime) >= 5*time.Second {
-					delete(s.presence[tenantID], userID)
+			// Queue the offline update before releasing the lock. A reconnect
+			// must register under this lock before queueing "online", so it
+			// can never be overwritten by a stale "offline".
+			h.mu.Lock()
+			defer h.mu.Unlock()
+
+			if state, exists := h.users[userID]; exists && len(state.clients) == 0 {
+				if time.Since(state.lastSeen) >= 5*time.Second {
+					delete(h.users, userID)
 					s.broadcastPresenceUpdate(tenantID, userID, "offline")
 				}
 			}
-			s.mu.Unlock()
 		})
 	}
 
-	slog.Info("WebSocket connection unregistered",
+	slog.Debug("WebSocket connection unregistered",
 		"tenant_id", tenantID,
 		"user_id", userID,
-		"remaining_connections", len(s.connections[tenantID][userID]))
+		"remaining_connections", len(state.clients))
 }
 
 // BroadcastToRoom broadcasts a message to all users in a room
 func (s *Service) BroadcastToRoom(tenantID, roomID string, message interface{}) {
+	s.broadcast(tenantID, roomID, "", message)
+}
+
+// BroadcastToRoomExcept broadcasts a message to all users in a room other
+// than exceptUserID, for events about that user that they don't need echoed
+func (s *Service) BroadcastToRoomExcept(tenantID, roomID, exceptUserID string, message interface{}) {
+	s.broadcast(tenantID, roomID, exceptUserID, message)
+}
+
+// broadcast queues a message for the room's connected members
+func (s *Service) broadcast(tenantID, roomID, exceptUserID string, message interface{}) {
+	// Encode on the caller's goroutine so the single broadcast worker only
+	// resolves recipients and queues frames
+	messageBytes, err := encodeMessage(message)
+	if err != nil {
+		slog.Error("Failed to marshal broadcast message",
+			"tenant_id", tenantID,
+			"room_id", roomID,
+			"error", err)
+		return
+	}
+
 	select {
 	case s.broadcastCh <- &broadcastMessage{
-		tenantID: tenantID,
-		roomID:   roomID,
-		message:  message,
+		tenantID:     tenantID,
+		roomID:       roomID,
+		exceptUserID: exceptUserID,
+		payload:      messageBytes,
 	}:
 	default:
 		slog.Warn("Broadcast channel full, dropping message",
@@ -128,60 +350,140 @@ func (s *Service) BroadcastToRoom(tenantID, roomID string, message interface{})
 	}
 }
 
-// SendToUser sends a message directly to a specific user
-func (s *Service) SendToUser(tenantID, userID string, message interface{}) {
-	s.mu.RLock()
-	connections, exists := s.connections[tenantID][userID]
-	s.mu.RUnlock()
+// SendToUser sends a message directly to a specific user and returns how
+// many of their connections it was queued on
+func (s *Service) SendToUser(tenantID, userID string, message interface{}) int {
+	var clients []*client
+	if h := s.hub(tenantID); h != nil {
+		clients = h.clientsOf(userID)
+	}
 
-	if !exists || len(connections) == 0 {
-		slog.Debug("No connections found for user, message not delivered",
-			"tenant_id", tenantID,
-			"user_id", userID)
-		return
+	if len(clients) == 0 {
+		// Delivery passes hit this for every offline user; typed attrs keep
+		// it free when debug logging is disabled
+		slog.LogAttrs(context.Background(), slog.LevelDebug, "No connections found for user, message not delivered",
+			slog.String("tenant_id", tenantID),
+			slog.String("user_id", userID))
+		return 0
 	}
 
-	messageBytes, err := json.Marshal(message)
+	messageBytes, err := encodeMessage(message)
 	if err != nil {
 		slog.Error("Failed to marshal message for user",
 			"tenant_id", tenantID,
 			"user_id", userID,
 			"error", err)
-		return
+		return 0
 	}
 
-	for _, conn := range connections {
-		if err := conn.WriteMessage(websocket.TextMessage, messageBytes); err != nil {
+	sent := 0
+	for _, c := range clients {
+		if err := c.write(messageBytes); err != nil {
 			slog.Warn("Failed to send message to user connection",
 				"tenant_id", tenantID,
 				"user_id", userID,
 				"error", err)
 			// Connection might be dead, but we'll let the connection handler deal with it
+			continue
+		}
+		sent++
+	}
+
+	return sent
+}
+
+// SendToUsers sends the same message to several users, encoding it once for
+// all of their connections, and returns how many connections it was queued on
+func (s *Service) SendToUsers(tenantID string, userIDs []string, message interface{}) int {
+	h := s.hub(tenantID)
+	if h == nil || len(userIDs) == 0 {
+		return 0
+	}
+
+	recipients := h.connectedRecipients(userIDs)
+	if len(recipients) == 0 {
+		return 0
+	}
+
+	messageBytes, err := encodeMessage(message)
+	if err != nil {
+		slog.Error("Failed to marshal message for users",
+			"tenant_id", tenantID,
+			"error", err)
+		return 0
+	}
+
+	sent := 0
+	for _, r := range recipients {
+		if err := r.client.write(messageBytes); err != nil {
+			slog.Warn("Failed to send message to user connection",
+				"tenant_id", tenantID,
+				"user_id", r.userID,
+				"error", err)
+			continue
+		}
+		sent++
+	}
+
+	return sent
+}
+
+// SendToConnection sends a message to a single connection of a user
+func (s *Service) SendToConnection(tenantID, userID string, conn *websocket.Conn, message interface{}) {
+	h := s.hub(tenantID)
+	if h == nil {
+		return
+	}
+
+	for _, c := range h.clientsOf(userID) {
+		if c.conn != conn {
+			continue
+		}
+
+		messageBytes, err := encodeMessage(message)
+		if err != nil {
+			slog.Error("Failed to marshal message for connection",
+				"tenant_id", tenantID,
+				"user_id", userID,
+				"error", err)
+			return
 		}
+
+		if err := c.write(messageBytes); err != nil {
+			slog.Warn("Failed to send message to user connection",
+				"tenant_id", tenantID,
+				"user_id", userID,
+				"error", err)
+		}
+		return
 	}
 }
 
 // IsUserOnline checks if a user has active connections
 func (s *Service) IsUserOnline(tenantID, userID string) bool {
-	s.mu.RLock()
-	defer s.mu.RUnlock()
+	h := s.hub(tenantID)
+	if h == nil {
+		return false
+	}
 
-	connections, exists := s.connections[tenantID][userID]
-	return exists && len(connections) > 0
+	return len(h.clientsOf(userID)) > 0
 }
 
 // GetOnlineUsers returns all currently online users for a tenant
 func (s *Service) GetOnlineUsers(tenantID string) []string {
-	s.mu.RLock()
-	defer s.mu.RUnlock()
+	h := s.hub(tenantID)
+	if h == nil {
+		return nil
+	}
 
-	var onlineUsers []string
-	if tenantPresence, exists := s.presence[tenantID]; exists {
-		for userID := range tenantPresence {
-			if s.IsUserOnline(tenantID, userID) {
-				onlineUsers = append(onlineUsers, userID)
-			}
-		}
+	h.mu.RLock()
+	defer h.mu.RUnlock()
+
+	// Read the online set rather than every tracked user: users inside their
+	// reconnect grace period or awaiting cleanup stay in h.users
+	onlineUsers := make([]string, 0, len(h.online))
+	for userID := range h.online {
+		onlineUsers = append(onlineUsers, userID)
 	}
 
 	return onlineUsers
@@ -192,33 +494,116 @@ func (s *Service) BroadcastPresenceUpdate(tenantID, userID, status string) {
 	s.broadcastPresenceUpdate(tenantID, userID, status)
 }
 
-// broadcastPresenceUpdate sends presence updates to relevant users
+// broadcastPresenceUpdate queues a presence change for the next flush. Only
+// the latest status per user is kept, so a user flapping within one window
+// produces a single update.
 func (s *Service) broadcastPresenceUpdate(tenantID, userID, status string) {
-	presenceMsg := map[string]interface{}{
-		"type":      "presence.update",
-		"user_id":   userID,
-		"status":    status,
-		"timestamp": time.Now().Unix(),
+	s.presenceMu.Lock()
+	defer s.presenceMu.Unlock()
+
+	if s.pendingPresence[tenantID] == nil {
+		s.pendingPresence[tenantID] = make(map[string]*models.WSPresenceEvent)
 	}
+	s.pendingPresence[tenantID][userID] = &models.WSPresenceEvent{
+		Type:      "presence.update",
+		UserID:    userID,
+		Status:    status,
+		Timestamp: time.Now().Unix(),
+	}
+}
 
-	// For now, broadcast to all connected users in the tenant
-	// In a more sophisticated implementation, you might track which users
-	// are subscribed to which presence updates
-	s.mu.RLock()
-	tenantConnections := s.connections[tenantID]
-	s.mu.RUnlock()
+// presenceFlushWorker periodically sends queued presence changes
+func (s *Service) presenceFlushWorker() {
+	ticker := time.NewTicker(presenceFlushInterval)
+	defer ticker.Stop()
 
-	messageBytes, err := json.Marshal(presenceMsg)
-	if err != nil {
-		slog.Error("Failed to marshal presence message", "error", err)
+	for {
+		select {
+		case <-ticker.C:
+			s.flushPresence()
+		case <-s.shutdownCh:
+			return
+		}
+	}
+}
+
+// flushPresence sends each tenant's queued presence changes, at most one
+// frame per recipient
+func (s *Service) flushPresence() {
+	s.presenceMu.Lock()
+	if len(s.pendingPresence) == 0 {
+		s.presenceMu.Unlock()
 		return
 	}
+	pending := s.pendingPresence
+	s.pendingPresence = make(map[string]map[string]*models.WSPresenceEvent)
+	s.presenceMu.Unlock()
 
-	for _, connections := range tenantConnections {
-		for _, conn := range connections {
-			if err := conn.WriteMessage(websocket.TextMessage, messageBytes); err != nil {
-				slog.Warn("Failed to send presence update", "error", err)
+	for tenantID, updates := range pending {
+		s.sendPresence(tenantID, updates)
+	}
+}
+
+// sendPresence delivers presence changes to the connected users who share a
+// room with each changed user, rather than to the whole tenant
+func (s *Service) sendPresence(tenantID string, updates map[string]*models.WSPresenceEvent) {
+	h := s.hub(tenantID)
+	if h == nil {
+		return
+	}
+
+	byRecipient := make(map[string][]*models.WSPresenceEvent)
+	for userID, event := range updates {
+		contacts, err := s.contactsOf(h, tenantID, userID)
+		if err != nil {
+			slog.Error("Failed to get contacts for presence update",
+				"tenant_id", tenantID,
+				"user_id", userID,
+				"error", err)
+			continue
+		}
+		for _, contact := range contacts {
+			byRecipient[contact] = append(byRecipient[contact], event)
+		}
+	}
+	if len(byRecipient) == 0 {
+		return
+	}
+
+	userIDs := make([]string, 0, len(byRecipient))
+	for userID := range byRecipient {
+		userIDs = append(userIDs, userID)
+	}
+
+	// Encode once per recipient user, shared by all of their connections
+	frames := make(map[string][]byte)
+	for _, r := range h.connectedRecipients(userIDs) {
+		frame, encoded := frames[r.userID]
+		if !encoded {
+			events := byRecipient[r.userID]
+
+			var payload interface{} = events[0]
+			if len(events) > 1 {
+				payload = &models.WSPresenceBatch{
+					Type:    "presence.batch",
+					Updates: events,
+				}
 			}
+
+			var err error
+			frame, err = encodeMessage(payload)
+			if err != nil {
+				slog.Error("Failed to marshal presence message", "error", err)
+				return
+			}
+			frames[r.userID] = frame
+		}
+
+		if err := r.client.write(frame); err != nil {
+			slog.Warn("Failed to send presence update",
+				"tenant_id", tenantID,
+				"user_id", r.userID,
+				"error", err)
 		}
 	}
 }
@@ -237,8 +622,13 @@ func (s *Service) broadcastWorker() {
 
 // processBroadcast handles a single broadcast message
 func (s *Service) processBroadcast(msg *broadcastMessage) {
-	// Query room members from database
-	roomMembers, err := s.getRoomMembers(msg.tenantID, msg.roomID)
+	// Nobody in the tenant is connected, so there is no one to deliver to
+	h := s.hub(msg.tenantID)
+	if h == nil {
+		return
+	}
+
+	roomMembers, err := s.roomMembers(h, msg.tenantID, msg.roomID)
 	if err != nil {
 		slog.Error("Failed to get room members for broadcast",
 			"tenant_id", msg.tenantID,
@@ -247,33 +637,69 @@ func (s *Service) processBroadcast(msg *broadcastMessage) {
 		return
 	}
 
-	messageBytes, err := json.Marshal(msg.message)
-	if err != nil {
-		slog.Error("Failed to marshal broadcast message",
-			"tenant_id", msg.tenantID,
-			"room_id", msg.roomID,
-			"error", err)
+	// Only broadcast to room members who are connected
+	recipients := h.connectedRecipients(roomMembers)
+	if len(recipients) == 0 {
 		return
 	}
 
-	s.mu.RLock()
-	tenantConnections := s.connections[msg.tenantID]
-	s.mu.RUnlock()
+	for _, r := range recipients {
+		if r.userID == msg.exceptUserID {
+			continue
+		}
+		if err := r.client.write(msg.payload); err != nil {
+			slog.Warn("Failed to broadcast message to user",
+				"tenant_id", msg.tenantID,
+				"user_id", r.userID,
+				"room_id", msg.roomID,
+				"error", err)
+		}
+	}
+}
 
-	// Only broadcast to room members who are connected
-	for _, memberID := range roomMembers {
-		if connections, exists := tenantConnections[memberID]; exists {
-			for _, conn := range connections {
-				if err := conn.WriteMessage(websocket.TextMessage, messageBytes); err != nil {
-					slog.Warn("Failed to broadcast message to user",
-						"tenant_id", msg.tenantID,
-						"user_id", memberID,
-						"room_id", msg.roomID,
-						"error", err)
-				}
-			}
+// roomMembers returns a room's member IDs, from the hub's cache while fresh
+// and from the database otherwise
+func (s *Service) roomMembers(h *tenantHub, tenantID, roomID string) ([]string, error) {
+	return h.cachedUserIDs(h.rooms, roomID, func() ([]string, error) {
+		// Query room members from database
+		return s.getRoomMembers(tenantID, roomID)
+	})
+}
+
+// contactsOf returns the users who share at least one room with a user, from
+// the hub's cache while fresh and from the database otherwise
+func (s *Service) contactsOf(h *tenantHub, tenantID, userID string) ([]string, error) {
+	return h.cachedUserIDs(h.contacts, userID, func() ([]string, error) {
+		return s.getContacts(tenantID, userID)
+	})
+}
+
+// getContacts retrieves the IDs of users who share a room with a user
+func (s *Service) getContacts(tenantID, userID string) ([]string, error) {
+	query := `
+		SELECT DISTINCT peer.user_id
+		FROM room_members self
+		JOIN room_members peer
+			ON peer.tenant_id = self.tenant_id AND peer.chatroom_id = self.chatroom_id
+		WHERE self.tenant_id = ? AND self.user_id = ? AND peer.user_id != self.user_id
+	`
+
+	rows, err := s.db.Query(query, tenantID, userID)
+	if err != nil {
+		return nil, err
+	}
+	defer rows.Close()
+
+	var contacts []string
+	for rows.Next() {
+		var contactID string
+		if err := rows.Scan(&contactID); err != nil {
+			return nil, err
 		}
+		contacts = append(contacts, contactID)
 	}
+
+	return contacts, rows.Err()
 }
 
 // getRoomMembers retrieves the list of user IDs who are members of a room
@@ -319,57 +745,81 @@ func (s *Service) presenceCleanupWorker() {
 
 // cleanupStalePresence removes presence entries for users who haven't been seen recently
 func (s *Service) cleanupStalePresence() {
-	s.mu.Lock()
-	defer s.mu.Unlock()
+	s.mu.RLock()
+	hubs := make(map[string]*tenantHub, len(s.tenants))
+	for tenantID, h := range s.tenants {
+		hubs[tenantID] = h
+	}
+	s.mu.RUnlock()
 
 	now := time.Now()
 	staleThreshold := 5 * time.Minute // Consider users offline after 5 minutes of no activity
 
-	for tenantID, tenantPresence := range s.presence {
-		for userID, lastSeen := range tenantPresence {
-			if now.Sub(lastSeen) > staleThreshold && !s.IsUserOnline(tenantID, userID) {
-				delete(s.presence[tenantID], userID)
+	// Sweep one tenant at a time so only that tenant's hub is locked
+	for tenantID, h := range hubs {
+		h.mu.Lock()
+		for userID, state := range h.users {
+			if now.Sub(state.lastSeen) > staleThreshold && len(state.clients) == 0 {
+				delete(h.users, userID)
 				slog.Debug("Cleaned up stale presence",
 					"tenant_id", tenantID,
 					"user_id", userID)
 			}
 		}
+		h.mu.Unlock()
 	}
 }
 
+// shutdownFrame tells clients the server is going away; it never changes, so
+// it is encoded once rather than per shutdown
+var shutdownFrame = []byte(`{"type":"server.shutdown","reconnect_after_ms":5000}`)
+
 // Shutdown gracefully shuts down the realtime service
 func (s *Service) Shutdown(ctx context.Context) error {
 	s.shutdownOnce.Do(func() {
 		close(s.shutdownCh)
 	})
 
-	// Close all connections
+	// Detach every connection from the registry, then notify and close them
+	// without holding any locks
 	s.mu.Lock()
-	defer s.mu.Unlock()
-
-	shutdownMsg := map[string]interface{}{
-		"type":               "server.shutdown",
-		"reconnect_after_ms": 5000,
+	var clients []*client
+	users := 0
+	for _, h := range s.tenants {
+		h.mu.Lock()
+		for _, state := range h.users {
+			if len(state.clients) == 0 {
+				continue
+			}
+			clients = append(clients, state.clients...)
+			users++
+		}
+		h.users = make(map[string]*userState)
+		h.online = make(map[string]struct{})
+		h.mu.Unlock()
 	}
 
-	messageBytes, _ := json.Marshal(shutdownMsg)
+	// Clear the registry
+	s.tenants = make(map[string]*tenantHub)
+	s.mu.Unlock()
 
-	for tenantID, tenantConnections := range s.connections {
-		for userID, connections := range tenantConnections {
-			for _, conn := range connections {
-				conn.WriteMessage(websocket.TextMessage, messageBytes)
-				conn.Close()
-			}
-			slog.Info("Closed connections for user",
-				"tenant_id", tenantID,
-				"user_id", userID,
-				"connections_closed", len(connections))
-		}
+	slog.Info("Closing WebSocket connections",
+		"users", users,
+		"connections", len(clients))
+
+	for _, c := range clients {
+		c.write(shutdownFrame)
+		c.close()
 	}
 
-	// Clear connection maps
-	s.connections = make(map[string]map[string][]*websocket.Conn)
-	s.presence = make(map[string]map[string]time.Time)
+	// Give each writer until the deadline to flush its queue before closing
+	for _, c := range clients {
+		select {
+		case <-c.stopped:
+		case <-ctx.Done():
+		}
+		c.conn.Close()
+	}
 
 	return nil
 }
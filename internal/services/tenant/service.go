@@ -2,22 +2,87 @@ package tenant
 
 import (
 	"crypto/rand"
+	"crypto/sha256"
 	"database/sql"
 	"encoding/hex"
 	"encoding/json"
+	"errors"
 	"fmt"
 	"log/slog"
 	"sync"
+	"time"
 
 	"github.com/hastenr/chatapi/internal/models"
 	"github.com/hastenr/chatapi/internal/ratelimit"
 )
 
+// Errors returned on the request rejection paths. They are shared values so
+// a flood of bad keys or over-limit requests doesn't build a new error each
+// time, and callers can match them with errors.Is.
+var (
+	ErrInvalidAPIKey     = errors.New("invalid API key")
+	ErrRateLimitExceeded = errors.New("rate limit exceeded")
+)
+
 // Service handles tenant operations
 type Service struct {
 	db            *sql.DB
 	rateLimiters  sync.Map // map[string]*ratelimit.TokenBucket
 	defaultRateLimit int
+	apiKeyCache   *apiKeyCache
+}
+
+// API key validation results are cached briefly so repeated requests and
+// reconnect storms don't query the tenants table every time
+const (
+	apiKeyCacheSize   = 10000
+	apiKeyCacheTTL    = 60 * time.Second
+	apiKeyNegativeTTL = 5 * time.Second
+)
+
+// apiKeyCache maps a hash of an API key to its tenant, or to nil for a key
+// that was recently rejected. Raw keys are never kept in memory.
+type apiKeyCache struct {
+	mu      sync.RWMutex
+	entries map[[sha256.Size]byte]apiKeyEntry
+}
+
+type apiKeyEntry struct {
+	tenant    *models.Tenant
+	expiresAt time.Time
+}
+
+// get returns the cached result for a key hash and whether one was found
+func (c *apiKeyCache) get(key [sha256.Size]byte) (*models.Tenant, bool) {
+	c.mu.RLock()
+	entry, exists := c.entries[key]
+	c.mu.RUnlock()
+
+	if !exists || time.Now().After(entry.expiresAt) {
+		return nil, false
+	}
+	return entry.tenant, true
+}
+
+// set caches a validation result, evicting expired entries when full
+func (c *apiKeyCache) set(key [sha256.Size]byte, tenant *models.Tenant, ttl time.Duration) {
+	c.mu.Lock()
+	defer c.mu.Unlock()
+
+	now := time.Now()
+	if len(c.entries) >= apiKeyCacheSize {
+		for k, entry := range c.entries {
+			if now.After(entry.expiresAt) {
+				delete(c.entries, k)
+			}
+		}
+		// Still full of live entries: start over rather than grow unbounded
+		if len(c.entries) >= apiKeyCacheSize {
+			c.entries = make(map[[sha256.Size]byte]apiKeyEntry)
+		}
+	}
+
+	c.entries[key] = apiKeyEntry{tenant: tenant, expiresAt: now.Add(ttl)}
 }
 
 // TenantConfig represents per-tenant configuration
@@ -33,11 +98,21 @@ func NewService(db *sql.DB) *Service {
 	return &Service{
 		db:               db,
 		defaultRateLimit: 100, // requests per second
+		apiKeyCache:      &apiKeyCache{entries: make(map[[sha256.Size]byte]apiKeyEntry)},
 	}
 }
 
 // ValidateAPIKey validates an API key and returns the tenant
 func (s *Service) ValidateAPIKey(apiKey string) (*models.Tenant, error) {
+	key := sha256.Sum256([]byte(apiKey))
+	if cached, found := s.apiKeyCache.get(key); found {
+		if cached == nil {
+			return nil, ErrInvalidAPIKey
+		}
+		tenant := *cached
+		return &tenant, nil
+	}
+
 	var tenant models.Tenant
 	query := `
 		SELECT tenant_id, api_key, name, config, created_at
@@ -54,13 +129,17 @@ func (s *Service) ValidateAPIKey(apiKey string) (*models.Tenant, error) {
 	)
 
 	if err == sql.ErrNoRows {
-		return nil, fmt.Errorf("invalid API key")
+		s.apiKeyCache.set(key, nil, apiKeyNegativeTTL)
+		return nil, ErrInvalidAPIKey
 	}
 	if err != nil {
 		slog.Error("Failed to validate API key", "error", err)
 		return nil, fmt.Errorf("database error")
 	}
 
+	cached := tenant
+	s.apiKeyCache.set(key, &cached, apiKeyCacheTTL)
+
 	return &tenant, nil
 }
 
@@ -171,7 +250,7 @@ func (s *Service) CheckRateLimit(tenantID string) error {
 	bucket := rateLimiter.(*ratelimit.TokenBucket)
 
 	if !bucket.Allow() {
-		return fmt.Errorf("rate limit exceeded")
+		return ErrRateLimitExceeded
 	}
 
 	return nil
@@ -23,6 +23,8 @@ type Server struct {
 	httpServer  *http.Server
 	config      *config.Config
 	realtimeSvc *realtime.Service
+	wsHandler   *ws.Handler
+	messageSvc  *message.Service
 }
 
 // NewServer creates a new HTTP server
@@ -39,7 +41,7 @@ func NewServer(
 	notifSvc := notification.NewService(db.DB)
 
 	restHandler := rest.NewHandler(tenantSvc, chatroomSvc, messageSvc, realtimeSvc, deliverySvc, notifSvc, cfg)
-	wsHandler := ws.NewHandler(tenantSvc, chatroomSvc, messageSvc, realtimeSvc)
+	wsHandler := ws.NewHandler(tenantSvc, chatroomSvc, messageSvc, realtimeSvc, deliverySvc)
 
 	// Create mux and register routes
 	mux := http.NewServeMux()
@@ -59,10 +61,8 @@ func NewServer(
 	mux.HandleFunc("/health", restHandler.HandleHealth)
 	mux.HandleFunc("/ws", wsHandler.HandleConnection)
 
-	// Mount protected routes with auth middleware
-	mux.Handle("/", restHandler.AuthMiddleware(func(w http.ResponseWriter, r *http.Request) {
-		protectedMux.ServeHTTP(w, r)
-	}))
+	// Mount protected routes; each one is already wrapped in the auth middleware
+	mux.Handle("/", protectedMux)
 
 	// Create HTTP server
 	httpServer := &http.Server{
@@ -77,6 +77,8 @@ func NewServer(
 		httpServer:  httpServer,
 		config:      cfg,
 		realtimeSvc: realtimeSvc,
+		wsHandler:   wsHandler,
+		messageSvc:  messageSvc,
 	}
 }
 
@@ -104,5 +106,13 @@ func (s *Server) Shutdown() {
 		slog.Error("Realtime service shutdown error", "error", err)
 	}
 
+	// Store acks still waiting out their debounce now that no more can arrive
+	s.wsHandler.FlushAcks()
+
+	// Release prepared statements before main closes the database
+	if err := s.messageSvc.Close(); err != nil {
+		slog.Error("Message service shutdown error", "error", err)
+	}
+
 	slog.Info("HTTP server shutdown complete")
 }
@@ -9,12 +9,17 @@ import (
 "github.com/hastenr/chatapi/internal/services/delivery"
 )
 
+// cleanupInterval is how often old entries are pruned; retention is measured
+// in days, so there is no need to sweep on every delivery pass
+const cleanupInterval = time.Hour
+
 // DeliveryWorker processes undelivered messages and notifications
 type DeliveryWorker struct {
 db          *db.DB
 deliverySvc *delivery.Service
 interval    time.Duration
 stopCh      chan struct{}
+lastCleanup time.Time
 }
 
 // NewDeliveryWorker creates a new delivery worker
@@ -73,10 +78,13 @@ slog.Error("Failed to process undelivered messages", "error", err, "tenant_id",
 if err := w.deliverySvc.ProcessNotifications(tenantID, 50); err != nil {
 slog.Error("Failed to process notifications", "error", err, "tenant_id", tenantID)
 }
+}
 
-// Cleanup old entries (older than 30 days)
-if err := w.deliverySvc.CleanupOldEntries(tenantID, 30*24*time.Hour); err != nil {
-slog.Error("Failed to cleanup old entries", "error", err, "tenant_id", tenantID)
+// Cleanup old entries (older than 30 days) for all tenants at once
+if time.Since(w.lastCleanup) >= cleanupInterval {
+w.lastCleanup = time.Now()
+if err := w.deliverySvc.CleanupOldEntries(30 * 24 * time.Hour); err != nil {
+slog.Error("Failed to cleanup old entries", "error", err)
 }
 }
 }